@@ -1,10 +1,11 @@
 import logging
 from auth import APIAuth
-import requests
 from requests.models import PreparedRequest
-import json
+import json_codec
 from typing import List, Optional
 
+from pydantic import ValidationError
+
 from entities import AlertHistoryRecord
 
 
@@ -37,18 +38,24 @@ class AlertHistoryService:
             params['showDismissed'] = 'true'
         
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         
         req = PreparedRequest()
         req.prepare_url(url, params)
         
-        response = requests.post(req.url, headers=headers, json=alert_ids)
+        response = self.api_auth.transport.post(req.url, headers=headers, json=alert_ids)
         
         if response.status_code == 200:
+            try:
+                # parse and validate the whole response in one pass
+                return json_codec.decode_models(response.content, list[AlertHistoryRecord])
+            except ValidationError:
+                # fall back to record by record so one bad record doesn't lose the rest
+                pass
+
             alert_history_records = []
-            json_response = json.loads(response.content.decode())
+            json_response = json_codec.loads(response.content)
             
             for record_data in json_response:
                 try:
@@ -61,28 +68,6 @@ class AlertHistoryService:
                     continue
             
             return alert_history_records
-        elif response.status_code == 401:
-            self.logger.warning("Unauthorized - refreshing token and retrying")
-            self.refresh_token()
-            headers["Authorization"] = "Bearer {}".format(self.api_auth.get_token())
-            response = requests.post(req.url, headers=headers, json=alert_ids)
-            
-            if response.status_code == 200:
-                alert_history_records = []
-                json_response = json.loads(response.content.decode())
-                
-                for record_data in json_response:
-                    try:
-                        alert_history_record = AlertHistoryRecord(**record_data)
-                        alert_history_records.append(alert_history_record)
-                    except Exception as e:
-                        self.logger.debug(f"Error parsing alert history record: {e}")
-                        continue
-                
-                return alert_history_records
-            else:
-                self.logger.error("Failed to list alert history after token refresh: {}".format(response.status_code))
-                return None
         else:
             self.logger.error("Failed to list alert history: {}".format(response.status_code))
             return None
@@ -104,32 +89,16 @@ class AlertHistoryService:
             'alertId': alert_id
         }
         
-        headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token())
-        }
-        
         req = PreparedRequest()
         req.prepare_url(url, params)
         
         self.logger.info(f"Dismissing AlertHistory for mac:{mac} type:{sensor_type} alertId:{alert_id}")
         
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url)
         
         if response.status_code == 200:
             self.logger.info(f"Dismissed AlertHistoryObject mac:{mac} type:{sensor_type} alertId:{alert_id}")
             return True
-        elif response.status_code == 401:
-            self.logger.warning("Unauthorized - refreshing token and retrying")
-            self.refresh_token()
-            headers["Authorization"] = "Bearer {}".format(self.api_auth.get_token())
-            response = requests.get(req.url, headers=headers)
-            
-            if response.status_code == 200:
-                self.logger.info(f"Dismissed AlertHistoryObject mac:{mac} type:{sensor_type} alertId:{alert_id}")
-                return True
-            else:
-                self.logger.error(f"Failed to dismiss alert history after token refresh: {response.status_code}")
-                return False
         else:
             self.logger.error(f"Could not dismiss alertHistoryObject! Status code: {response.status_code}")
             return False
@@ -151,16 +120,10 @@ class AlertHistoryService:
         
         enriched_records = []
         
-        # Create a lookup map for sensors by MAC
-        sensor_map = {}
-        for location_view in client_location_view.locationSensorViews:
-            for sensor in location_view.sensorList:
-                sensor_map[sensor.mac] = sensor
-        
         for record in alert_history_records:
             try:
                 # Find the sensor for this record
-                sensor = sensor_map.get(record.mac)
+                sensor = client_location_view.get_sensor_by_mac(record.mac)
                 
                 if sensor:
                     enriched_record = {
@@ -1,8 +1,6 @@
 import logging
 from auth import APIAuth
-import requests
-from requests.models import PreparedRequest
-import json
+import json_codec
 from typing import List, Optional
 
 from entities import Alert, WebServiceBoolean
@@ -31,39 +29,10 @@ class AlertService:
         """
         url = self.api_auth.api_config.get_api_url() + "alert/list"
         
-        headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token())
-        }
-        
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
         
         if response.status_code == 200:
-            alerts = []
-            json_response = json.loads(response.content.decode())
-            
-            for alert_data in json_response:
-                alert = Alert(**alert_data)
-                alerts.append(alert)
-            
-            return alerts
-        elif response.status_code == 401:
-            self.logger.warning("Unauthorized - refreshing token and retrying")
-            self.refresh_token()
-            headers["Authorization"] = "Bearer {}".format(self.api_auth.get_token())
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                alerts = []
-                json_response = json.loads(response.content.decode())
-                
-                for alert_data in json_response:
-                    alert = Alert(**alert_data)
-                    alerts.append(alert)
-                
-                return alerts
-            else:
-                self.logger.error("Failed to list alerts after token refresh: {}".format(response.status_code))
-                return None
+            return json_codec.decode_models(response.content, list[Alert])
         else:
             self.logger.error("Failed to list alerts: {}".format(response.status_code))
             return None
@@ -78,30 +47,17 @@ class AlertService:
         url = self.api_auth.api_config.get_api_url() + "alert/save"
         
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         
         # Convert Alert object to dict for JSON serialization
         alert_dict = alert.model_dump(exclude_none=True)
         
-        response = requests.post(url, headers=headers, json=alert_dict)
+        response = self.api_auth.transport.post(url, headers=headers, json=alert_dict)
         
         if response.status_code == 200:
-            json_response = json.loads(response.content.decode())
+            json_response = json_codec.loads(response.content)
             return Utils.unmarshall_webservice_bool(json_response)
-        elif response.status_code == 401:
-            self.logger.warning("Unauthorized - refreshing token and retrying")
-            self.refresh_token()
-            headers["Authorization"] = "Bearer {}".format(self.api_auth.get_token())
-            response = requests.post(url, headers=headers, json=alert_dict)
-            
-            if response.status_code == 200:
-                json_response = json.loads(response.content.decode())
-                return Utils.unmarshall_webservice_bool(json_response)
-            else:
-                self.logger.error("Failed to save alert after token refresh: {}".format(response.status_code))
-                return WebServiceBoolean(False, "Failed to save alert after token refresh")
         else:
             self.logger.error("Failed to save alert: {}".format(response.status_code))
             return WebServiceBoolean(False, "Failed to save alert")
@@ -116,30 +72,17 @@ class AlertService:
         url = self.api_auth.api_config.get_api_url() + "alert/update"
         
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         
         # Convert Alert object to dict for JSON serialization
         alert_dict = alert.model_dump(exclude_none=True)
         
-        response = requests.post(url, headers=headers, json=alert_dict)
+        response = self.api_auth.transport.post(url, headers=headers, json=alert_dict)
         
         if response.status_code == 200:
-            json_response = json.loads(response.content.decode())
+            json_response = json_codec.loads(response.content)
             return Utils.unmarshall_webservice_bool(json_response)
-        elif response.status_code == 401:
-            self.logger.warning("Unauthorized - refreshing token and retrying")
-            self.refresh_token()
-            headers["Authorization"] = "Bearer {}".format(self.api_auth.get_token())
-            response = requests.post(url, headers=headers, json=alert_dict)
-            
-            if response.status_code == 200:
-                json_response = json.loads(response.content.decode())
-                return Utils.unmarshall_webservice_bool(json_response)
-            else:
-                self.logger.error("Failed to update alert after token refresh: {}".format(response.status_code))
-                return WebServiceBoolean(False, "Failed to update alert after token refresh")
         else:
             self.logger.error("Failed to update alert: {}".format(response.status_code))
             return WebServiceBoolean(False, "Failed to update alert")
@@ -154,30 +97,17 @@ class AlertService:
         url = self.api_auth.api_config.get_api_url() + "alert/remove"
         
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         
         # Convert Alert object to dict for JSON serialization
         alert_dict = alert.model_dump(exclude_none=True)
         
-        response = requests.post(url, headers=headers, json=alert_dict)
+        response = self.api_auth.transport.post(url, headers=headers, json=alert_dict)
         
         if response.status_code == 200:
-            json_response = json.loads(response.content.decode())
+            json_response = json_codec.loads(response.content)
             return Utils.unmarshall_webservice_bool(json_response)
-        elif response.status_code == 401:
-            self.logger.warning("Unauthorized - refreshing token and retrying")
-            self.refresh_token()
-            headers["Authorization"] = "Bearer {}".format(self.api_auth.get_token())
-            response = requests.post(url, headers=headers, json=alert_dict)
-            
-            if response.status_code == 200:
-                json_response = json.loads(response.content.decode())
-                return Utils.unmarshall_webservice_bool(json_response)
-            else:
-                self.logger.error("Failed to remove alert after token refresh: {}".format(response.status_code))
-                return WebServiceBoolean(False, "Failed to remove alert after token refresh")
         else:
             self.logger.error("Failed to remove alert: {}".format(response.status_code))
             return WebServiceBoolean(False, "Failed to remove alert")
@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from sensor_type_info import APISensorTypeInfo
+
+
+@dataclass
+class AlignedBatch:
+    """
+    A batch of time aligned multivariate rows, one row per emitted (mac, time) with one column per required type
+    """
+    types: list[int]
+    macs: np.ndarray
+    timestamps: np.ndarray
+    values: np.ndarray
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __repr__(self):
+        return "AlignedBatch({} rows x {} types)".format(len(self), len(self.types))
+
+    def to_frame(self, sensor_type_info: APISensorTypeInfo = None) -> pd.DataFrame:
+        """
+        Converts the batch to a DataFrame with mac and timestamp columns followed by one column per type
+
+        :param sensor_type_info: optional; used to label the type columns, otherwise the type numbers are used
+        """
+        if sensor_type_info is not None:
+            labels = sensor_type_info.get_labels(self.types)
+        else:
+            labels = [str(sensor_type) for sensor_type in self.types]
+
+        df = pd.DataFrame(self.values, columns=labels)
+        df.insert(0, "timestamp", self.timestamps)
+        df.insert(0, "mac", self.macs)
+        return df
+
+
+class AlignmentEngine:
+    """
+    Streaming multivariate alignment for many MACs at once (replaces the Utils.add_sensor_datum / is_full_and_aligned /
+    get_datum_df workflow)
+
+    Each MAC gets a fixed row of slots, one per required type, holding the latest reading of that type. When every slot
+    of a MAC is filled and the readings are within max_timestamp_diff of one another, a row is emitted (timestamp = mean
+    of the reading timestamps, like get_datum_df) and the slots are cleared. Rows are collected and handed over in
+    batches of batch_size rows, or when the oldest waiting row is max_batch_age_ms old
+
+    Each reading only touches the slots of its own MAC, so the cost per reading doesn't grow with the number of MACs
+    """
+
+    def __init__(self, required_types: list,
+                 max_timestamp_diff: int = 30000,
+                 batch_size: int = 1000,
+                 max_batch_age_ms: int = 1000,
+                 on_batch: Callable[[AlignedBatch], None] = None,
+                 reset_on_emit: bool = True,
+                 initial_capacity: int = 1024):
+        """
+        :param required_types: the sensor types that make up a row (the column order of the output)
+        :param max_timestamp_diff: the maximum spread in milliseconds of the readings in a row
+        :param batch_size: the number of rows per batch
+        :param max_batch_age_ms: the maximum time a row waits before its batch is handed over (checked on add and flush_if_due)
+        :param on_batch: optional; called with each AlignedBatch, otherwise collect batches with flush()
+        :param reset_on_emit: clear a MAC's slots after emitting a row, if False every new reading that keeps the
+        slots aligned emits another row (the behaviour of the Utils functions)
+        :param initial_capacity: the number of MAC rows to allocate up front (grows as needed)
+        """
+        self.types = [int(sensor_type) for sensor_type in required_types]
+        self.max_timestamp_diff = max_timestamp_diff
+        self.batch_size = batch_size
+        self.max_batch_age_ms = max_batch_age_ms
+        self.on_batch = on_batch
+        self.reset_on_emit = reset_on_emit
+        self.logger = logging.getLogger(__name__)
+
+        self._columns = {sensor_type: i for i, sensor_type in enumerate(self.types)}
+        self._rows = {}
+        self._lock = threading.Lock()
+
+        n_types = len(self.types)
+        self._values = np.zeros((initial_capacity, n_types), dtype=np.float64)
+        self._timestamps = np.zeros((initial_capacity, n_types), dtype=np.int64)
+        self._present = np.zeros((initial_capacity, n_types), dtype=bool)
+        self._filled = np.zeros(initial_capacity, dtype=np.int32)
+
+        self._pending_macs = []
+        self._pending_timestamps = []
+        self._pending_values = []
+        self._pending_since = None
+
+        self.readings = 0
+        self.rows_emitted = 0
+
+    def add(self, mac: int, sensor_type: int, timestamp: int, data: float) -> bool:
+        """
+        Add one reading
+
+        :return: True if the reading completed an aligned row
+        """
+        column = self._columns.get(int(sensor_type))
+
+        with self._lock:
+            self.readings += 1
+            if column is None:
+                return False
+
+            row = self._rows.get(mac)
+            if row is None:
+                row = self._add_mac(mac)
+
+            if not self._present[row, column]:
+                self._present[row, column] = True
+                self._filled[row] += 1
+            self._values[row, column] = data
+            self._timestamps[row, column] = timestamp
+
+            emitted = False
+            if self._filled[row] == len(self.types):
+                timestamps = self._timestamps[row]
+                if timestamps.max() - timestamps.min() <= self.max_timestamp_diff:
+                    self._emit(mac, row)
+                    emitted = True
+
+            batch = self._take_batch_if_due()
+
+        if batch is not None:
+            self._deliver(batch)
+
+        return emitted
+
+    def add_datum(self, sensor_datum: dict) -> bool:
+        """
+        Add a reading in the API / websocket form { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 }
+        """
+        return self.add(int(sensor_datum['mac']), sensor_datum['type'], int(sensor_datum['timestamp']),
+                        float(sensor_datum['data']))
+
+    def flush(self) -> Optional[AlignedBatch]:
+        """
+        Hand over the waiting rows now
+
+        :return: the batch (also passed to on_batch), or None if no rows were waiting
+        """
+        with self._lock:
+            batch = self._take_batch()
+
+        if batch is not None:
+            self._deliver(batch)
+        return batch
+
+    def flush_if_due(self) -> Optional[AlignedBatch]:
+        """
+        Hand over the waiting rows if the oldest is max_batch_age_ms old (call periodically when readings are sparse)
+        """
+        with self._lock:
+            batch = self._take_batch_if_due()
+
+        if batch is not None:
+            self._deliver(batch)
+        return batch
+
+    def reset(self, mac: int = None):
+        """
+        Clear the slots of a MAC (or of every MAC)
+        """
+        with self._lock:
+            if mac is None:
+                self._present[:] = False
+                self._filled[:] = 0
+            elif mac in self._rows:
+                row = self._rows[mac]
+                self._present[row] = False
+                self._filled[row] = 0
+
+    def _add_mac(self, mac: int) -> int:
+        """Give a new MAC a row of slots, growing the arrays if they are full (the caller holds the lock)"""
+        row = len(self._rows)
+        if row >= len(self._filled):
+            capacity = 2 * len(self._filled)
+            self._values = np.resize(self._values, (capacity, len(self.types)))
+            self._timestamps = np.resize(self._timestamps, (capacity, len(self.types)))
+            present = np.zeros((capacity, len(self.types)), dtype=bool)
+            present[:row] = self._present[:row]
+            self._present = present
+            filled = np.zeros(capacity, dtype=np.int32)
+            filled[:row] = self._filled[:row]
+            self._filled = filled
+
+        self._rows[mac] = row
+        return row
+
+    def _emit(self, mac: int, row: int):
+        """Queue the aligned row of a MAC (the caller holds the lock)"""
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+
+        self._pending_macs.append(mac)
+        self._pending_timestamps.append(int(self._timestamps[row].mean()))
+        self._pending_values.append(self._values[row].copy())
+        self.rows_emitted += 1
+
+        if self.reset_on_emit:
+            self._present[row] = False
+            self._filled[row] = 0
+
+    def _take_batch_if_due(self) -> Optional[AlignedBatch]:
+        """(the caller holds the lock)"""
+        if len(self._pending_macs) >= self.batch_size or (
+                self._pending_since is not None and
+                (time.monotonic() - self._pending_since) * 1000 >= self.max_batch_age_ms):
+            return self._take_batch()
+        return None
+
+    def _take_batch(self) -> Optional[AlignedBatch]:
+        """(the caller holds the lock)"""
+        if len(self._pending_macs) == 0:
+            return None
+
+        batch = AlignedBatch(
+            types=list(self.types),
+            macs=np.array(self._pending_macs, dtype=np.int64),
+            timestamps=np.array(self._pending_timestamps, dtype=np.int64),
+            values=np.vstack(self._pending_values)
+        )
+        self._pending_macs = []
+        self._pending_timestamps = []
+        self._pending_values = []
+        self._pending_since = None
+        return batch
+
+    def _deliver(self, batch: AlignedBatch):
+        if self.on_batch is None:
+            return
+        try:
+            self.on_batch(batch)
+        except Exception as e:
+            self.logger.warning("Exception in the on_batch callback: {}".format(e))
@@ -1,8 +1,7 @@
 import logging
 
 from auth import APIAuth
-import requests
-import json
+import json_codec
 
 
 class APICache:
@@ -15,16 +14,15 @@ class APICache:
         base_url = self.api_auth.api_config.get_api_url() + "sensorreport/latest"
 
         headers = {
-            "Authorization": "Bearer " + self.api_auth.get_token(),
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
 
-        response = requests.post(base_url, headers=headers, data=json.dumps(macs))
+        response = self.api_auth.transport.post(base_url, headers=headers, data=json_codec.dumps(macs))
 
         if response.status_code == 200:
 
-            json_response = json.loads(response.content.decode())
+            json_response = json_codec.loads(response.content)
 
             return json_response
 
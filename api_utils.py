@@ -1,8 +1,8 @@
 import logging
-import requests
 import pandas as pd
 import plotly.graph_objects as go
 from auth import APIAuth
+import json_codec
 from entities import Alert, AlertHistoryRecord
 
 
@@ -26,13 +26,12 @@ class APIUtils:
         self.logger.info(f"Fetching AlertHistoryRecord for {eventId}")
 
         url = f"{self.api_auth.api_config.get_api_url()}alertlog/getbyeventid?eventId={eventId}"
-        headers = {'Authorization': f"Bearer {self.api_auth.get_token()}"}
 
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
 
         if response.status_code == 200:
             # Parse the JSON response into an AlertHistoryRecord model
-            return AlertHistoryRecord(**response.json())
+            return json_codec.decode_models(response.content, AlertHistoryRecord)
         else:
             response.raise_for_status()
 
@@ -40,13 +39,12 @@ class APIUtils:
         self.logger.info(f"Fetching alerts")
 
         url = f"{self.api_auth.api_config.get_api_url()}alert/list"
-        headers = {'Authorization': f"Bearer {self.api_auth.get_token()}"}
 
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
 
         if response.status_code == 200:
             # Parse the JSON response into a list of Alert models
-            return [Alert(**alert) for alert in response.json()]
+            return json_codec.decode_models(response.content, list[Alert])
         else:
             response.raise_for_status()
 
@@ -66,9 +64,6 @@ class APIUtils:
             f"Fetching sensor data for: mac={mac}, start={start_timestamp}, end={end_timestamp}, sensortypes={sensortypes}")
 
         url = f"{self.api_auth.api_config.get_api_url()}sensordata/byrange"
-        headers = {
-            "Authorization": f"Bearer {self.api_auth.get_token()}"
-        }
         params = {
             "mac": mac,
             "begin": start_timestamp,
@@ -90,12 +85,12 @@ class APIUtils:
         }
 
         # Fetch the sensor data from the API
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
         if response.status_code != 200:
             response.raise_for_status()
 
         # Parse the sensor data
-        sensor_data = response.json()
+        sensor_data = json_codec.loads(response.content)
 
         # Separate the data by type
         data_by_type = {}
@@ -145,9 +140,6 @@ class APIUtils:
             f"Fetching chart image for: {mac} start:{start_timestamp} end:{end_timestamp} sensortype:{sensortype}")
 
         url = f"{self.api_auth.api_config.get_api_url()}sensordata/chartimage"
-        headers = {
-            "Authorization": f"Bearer {self.api_auth.get_token()}"
-        }
         params = {
             "mac": mac,
             "begin": start_timestamp,
@@ -170,7 +162,7 @@ class APIUtils:
             "interpolateType": 0
         }
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
             return response.content  # Returns the image data in PNG format
@@ -1,25 +1,43 @@
 import logging
 import random
+import threading
+import time
 from typing import Optional, List
 from auth import APIAuth
-import requests
-import json
-from entities import ClientLocationView, Sensor, Location, LocationSensorView
+import json_codec
+from entities import ClientLocationView, Sensor, Location, LocationSensorView, BuildingMap
+from snapshot import load_snapshot, write_snapshot
 from utils import Utils as AUtils
 
 
 class APIClient:
     """Various methods for interacting with the Client BO (Business Object) stuff."""
 
-    def __init__(self, api_auth: APIAuth):
+    def __init__(self, api_auth: APIAuth, ttl_ms: int = None, background_refresh: bool = True,
+                 retry_interval_ms: int = 30000, snapshot_path: str = None):
         """
         Initializes the APIClient with the provided API authentication.
 
         Args:
             api_auth (APIAuth): An instance of APIAuth containing authentication details.
+            ttl_ms (int): How long the cached Client Location View is used before it is refreshed, None to keep it
+                until get_client_location_view is called again.
+            background_refresh (bool): If True, an expired view keeps being served while a background thread fetches
+                the new one and swaps it in (stale-while-revalidate), otherwise the view is re-fetched on the caller's thread.
+            retry_interval_ms (int): How long to wait before trying again after a failed background refresh.
+            snapshot_path (str): A local file the view is saved to whenever it changes. On start up the view is loaded
+                from it straight away (no network call) and refreshed from the API in the background.
         """
         self.api_auth = api_auth
+        self.ttl_ms = ttl_ms
+        self.background_refresh = background_refresh
+        self.retry_interval_ms = retry_interval_ms
+        self.snapshot_path = snapshot_path
         self._client_location_view: Optional[ClientLocationView] = None
+        self._view_data = None
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self._refresh_lock = threading.Lock()
         self.logger = logging.getLogger(__name__)
 
     def get_client_location_view(self, invalidate_cache: bool = False) -> Optional[ClientLocationView]:
@@ -35,13 +53,19 @@ class APIClient:
         params = {
             'invalidateCache': 'true' if invalidate_cache else 'false'
         }
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         url = self.api_auth.api_config.get_api_url() + "client/locationview"
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = json.loads(response.content.decode())
+            data = json_codec.loads(response.content)
+            # the view (and its indexes) is built completely before it is swapped in
             self._client_location_view = ClientLocationView.from_dict(data)
+            self._fetched_at = time.monotonic()
+
+            if self.snapshot_path is not None and data != self._view_data:
+                write_snapshot(self.snapshot_path, data)
+            self._view_data = data
+
             return self._client_location_view
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -54,9 +78,7 @@ class APIClient:
         Returns:
             List[LocationSensorView]: A list of LocationSensorView objects representing active locations.
         """
-        if not self._client_location_view:
-            self.get_client_location_view()
-        devices_and_locations = self._client_location_view.locationSensorViews
+        devices_and_locations = self._get_view().locationSensorViews
         return [location for location in devices_and_locations if location.lastSensorReportTime != -1]
 
     def get_active_devices(self, duration: int = (24 * 60 * 60 * 1000)) -> List[Sensor]:
@@ -87,9 +109,7 @@ class APIClient:
         Returns:
             List[Location]: A list of Location objects.
         """
-        if not self._client_location_view:
-            self.get_client_location_view()
-        devices_and_locations = self._client_location_view.locationSensorViews
+        devices_and_locations = self._get_view().locationSensorViews
         return [location.location for location in devices_and_locations]
 
     def get_location_by_id(self, location_id: str) -> Optional[LocationSensorView]:
@@ -102,13 +122,7 @@ class APIClient:
         Returns:
             Optional[LocationSensorView]: The LocationSensorView object if found, otherwise None.
         """
-        if not self._client_location_view:
-            self.get_client_location_view()
-        devices_and_locations = self._client_location_view.locationSensorViews
-        for location in devices_and_locations:
-            if location.location.id == location_id:
-                return location
-        return None
+        return self._get_view().get_location_view_by_id(location_id)
 
     def get_device_by_id(self, device_id: str) -> Optional[Sensor]:
         """
@@ -120,14 +134,7 @@ class APIClient:
         Returns:
             Optional[Sensor]: The Sensor object if found, otherwise None.
         """
-        if not self._client_location_view:
-            self.get_client_location_view()
-        devices_and_locations = self._client_location_view.locationSensorViews
-        for location in devices_and_locations:
-            for device in location.sensorList:
-                if device.id == device_id:
-                    return device
-        return None
+        return self._get_view().get_sensor_by_id(device_id)
 
     def get_sensor_by_mac(self, mac: int) -> Optional[Sensor]:
         """
@@ -139,15 +146,22 @@ class APIClient:
         Returns:
             Optional[Sensor]: The Sensor object if found, otherwise None.
         """
-        if not self._client_location_view:
-            self.get_client_location_view()
-        devices_and_locations = self._client_location_view.locationSensorViews
-        for location in devices_and_locations:
-            for sensor in location.sensorList:
-                if sensor.mac == mac:
-                    return sensor
-        self.logger.warning(f"Sensor with MAC {mac} not found.")
-        return None
+        sensor = self._get_view().get_sensor_by_mac(mac)
+        if sensor is None:
+            self.logger.warning(f"Sensor with MAC {mac} not found.")
+        return sensor
+
+    def get_building_map_by_id(self, building_map_id: str) -> Optional[BuildingMap]:
+        """
+        Retrieves a BuildingMap by its ID.
+
+        Args:
+            building_map_id (str): The ID of the building map to retrieve.
+
+        Returns:
+            Optional[BuildingMap]: The BuildingMap object if found, otherwise None.
+        """
+        return self._get_view().get_building_map_by_id(building_map_id)
 
     def get_random_location_with_building_map(self) -> Optional[LocationSensorView]:
         """
@@ -156,13 +170,10 @@ class APIClient:
         Returns:
             Optional[Location]: A Location object with at least one BuildingMap, or None if no such location exists.
         """
-        if not self._client_location_view:
-            self.get_client_location_view()
-
         # Filter locations that have at least one building map
         locations_with_building_maps = [
             location_view
-            for location_view in self._client_location_view.locationSensorViews
+            for location_view in self._get_view().locationSensorViews
             if location_view.buildingMapList
         ]
 
@@ -171,3 +182,61 @@ class APIClient:
         else:
             self.logger.warning("No locations with BuildingMaps found.")
             return None
+
+    def _get_view(self) -> Optional[ClientLocationView]:
+        """
+        Gets the cached Client Location View, fetching it if there isn't one yet and refreshing it if it has expired
+        (in the background if background_refresh is set, so the caller gets the current view without waiting)
+        """
+        view = self._client_location_view
+        if view is None and self.snapshot_path is not None:
+            view = self._load_snapshot()
+        if view is None:
+            return self.get_client_location_view()
+
+        if self.ttl_ms is None or (time.monotonic() - self._fetched_at) * 1000 < self.ttl_ms:
+            return view
+
+        if not self.background_refresh:
+            return self.get_client_location_view() or view
+
+        if (time.monotonic() - self._last_attempt) * 1000 >= self.retry_interval_ms and \
+                self._refresh_lock.acquire(blocking=False):
+            self._last_attempt = time.monotonic()
+            threading.Thread(target=self._refresh, name="ClientLocationViewRefresh", daemon=True).start()
+
+        return view
+
+    def _load_snapshot(self) -> Optional[ClientLocationView]:
+        """
+        Loads the view from the snapshot file and starts refreshing it from the API in the background
+        """
+        with self._refresh_lock:
+            if self._client_location_view is not None:
+                return self._client_location_view
+
+            snapshot = load_snapshot(self.snapshot_path)
+            if snapshot is None:
+                return None
+
+            self._view_data = snapshot[0]
+            self._client_location_view = ClientLocationView.from_dict(self._view_data)
+            self.logger.info("Loaded the Client Location View from {}".format(self.snapshot_path))
+
+        if self._refresh_lock.acquire(blocking=False):
+            self._last_attempt = time.monotonic()
+            threading.Thread(target=self._refresh, name="ClientLocationViewRefresh", daemon=True).start()
+
+        return self._client_location_view
+
+    def _refresh(self):
+        """
+        Fetches a new Client Location View in the background (the caller holds the refresh lock)
+        """
+        try:
+            if self.get_client_location_view() is None:
+                self.logger.warning("Could not refresh the Client Location View, still using the cached one")
+        except Exception as e:
+            self.logger.warning("Exception refreshing the Client Location View: {}".format(e))
+        finally:
+            self._refresh_lock.release()
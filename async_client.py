@@ -0,0 +1,750 @@
+import asyncio
+import collections
+import json_codec
+import logging
+import math
+import time
+from dataclasses import dataclass
+
+import aiohttp
+import pandas as pd
+from multidict import CIMultiDict
+import requests.utils as r_utils
+from yarl import URL
+
+from api_config import APIConfig
+from auth import APIAuth
+from client_websocket import SENSOR_DATA_EVENTS_URL
+from entities import SensorDatum, SensorDataBlock, MultiMacQueryResult
+from sensor_data_ingest import SensorDataIngest, zstandard
+from sensor_data_query import SensorDataQuery
+from transport import APITransport, DEFAULT_TIMEOUT, ENDPOINT_TIMEOUTS, IDEMPOTENT_METHODS, is_retry_status, retry_delay
+
+
+@dataclass
+class AsyncResponse:
+    """The parts of an aiohttp response the clients use, read completely so the connection can be released"""
+    status_code: int
+    # case-insensitive, like requests' response headers
+    headers: CIMultiDict
+    content: bytes
+
+
+class AsyncAPITransport:
+    """
+    asyncio counterpart of APITransport
+    A single aiohttp.ClientSession (created on first use, inside the running event loop) is shared by all the
+    async clients, so thousands of concurrent requests can run on one event loop over a bounded connection pool
+
+    Requests go through the same retry policy and per endpoint timeouts as APITransport
+    """
+
+    # the per endpoint timeouts are shared with APITransport
+    set_timeout = APITransport.set_timeout
+    timeout_for = APITransport.timeout_for
+
+    def __init__(self, api_auth, limit: int = 100, limit_per_host: int = 0,
+                 max_retries: int = 3, backoff_factor: float = 0.5, max_backoff: float = 30.0,
+                 timeout: tuple[float, float] = DEFAULT_TIMEOUT):
+        """
+        :param api_auth: the AsyncAPIAuth object used to add the bearer token to authenticated requests
+        :param limit: the maximum number of open connections
+        :param limit_per_host: the maximum number of open connections per host (0 for no per host limit)
+        :param max_retries: the maximum number of retries after 429 / 5xx responses or connection failures
+        :param backoff_factor: the base delay between retries in seconds
+        :param max_backoff: the maximum delay between retries in seconds
+        :param timeout: the default (connect, read) timeout in seconds
+        """
+        self.api_auth = api_auth
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.endpoint_timeouts = dict(ENDPOINT_TIMEOUTS)
+        self.logger = logging.getLogger(__name__)
+        self.session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    @staticmethod
+    def _client_timeout(timeout: tuple[float, float] | float) -> aiohttp.ClientTimeout:
+        if isinstance(timeout, tuple):
+            return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        return aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+
+    async def auth_headers(self, headers: dict = None, refresh_if_expired: bool = False) -> dict:
+        """
+        Get a copy of headers with the Authorization header added
+        """
+        ret = dict(headers) if headers else dict()
+        token = await self.api_auth.get_token(refresh_if_expired=refresh_if_expired)
+        if token is not None:
+            ret["Authorization"] = "Bearer " + token
+        return ret
+
+    async def request(self, method: str, url: str,
+                      authenticate: bool = True,
+                      refresh_if_expired: bool = False,
+                      headers: dict = None,
+                      retry: bool = True,
+                      **kwargs) -> AsyncResponse:
+        """
+        Send a request over the pooled session and read the whole response, see APITransport.request
+
+        :param method: the HTTP verb
+        :param url: the full (already encoded) URL of the endpoint
+        :param authenticate: whether to add the bearer token to the request
+        :param refresh_if_expired: passed through to AsyncAPIAuth.get_token
+        :param headers: any additional headers for the request
+        :param retry: whether to apply the retry policy
+        :param kwargs: passed through to aiohttp.ClientSession.request (data, json, etc.)
+        :return: an AsyncResponse
+        """
+        kwargs.setdefault("timeout", self._client_timeout(self.timeout_for(url)))
+        max_retries = self.max_retries if retry else 0
+        replayed = not (retry and authenticate) or self.api_auth._token_provided
+        attempt = 0
+
+        while True:
+            request_headers = await self.auth_headers(headers, refresh_if_expired) if authenticate else headers
+
+            try:
+                # the URLs are built with PreparedRequest and are already encoded
+                async with self._get_session().request(method, URL(url, encoded=True),
+                                                       headers=request_headers, **kwargs) as raw_response:
+                    content = await raw_response.read()
+                    response = AsyncResponse(raw_response.status, CIMultiDict(raw_response.headers), content)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # a read timeout may mean the server acted on the request, only replay it if it's idempotent
+                replayable = isinstance(e, aiohttp.ClientConnectorError) or method.upper() in IDEMPOTENT_METHODS
+                if attempt >= max_retries or not replayable:
+                    raise
+                delay = retry_delay(None, attempt, self.backoff_factor, self.max_backoff)
+                self.logger.warning("{} {} failed ({}), retrying in {:.1f}s".format(method, url, e, delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code in (401, 403) and not replayed:
+                replayed = True
+                rejected = (request_headers or {}).get("Authorization", "")[len("Bearer "):]
+                self.logger.info("Response [{}], refreshing authtoken and replaying the request"
+                                 .format(response.status_code))
+                await self.api_auth.refresh_token(stale_token=rejected or None)
+                continue
+
+            if is_retry_status(method, response.status_code) and attempt < max_retries:
+                delay = retry_delay(response.headers, attempt, self.backoff_factor, self.max_backoff)
+                self.logger.warning("Response [{}] from {}, retrying in {:.1f}s".format(response.status_code, url, delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    async def get(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        """Close all the pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncAPIAuth:
+    """
+    asyncio counterpart of APIAuth, with the same expiry tracking
+    The token is refreshed under an asyncio.Lock, so when many coroutines need a token at the same time
+    only one of them goes to the API for it and the rest wait for its result
+    """
+
+    # the expiry bookkeeping is shared with APIAuth
+    _set_token = APIAuth._set_token
+    _observe_rejection = APIAuth._observe_rejection
+    _needs_refresh = APIAuth._needs_refresh
+
+    def __init__(self, config_obj: APIConfig, token: str = None,
+                 limit: int = 100, limit_per_host: int = 0, timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+                 refresh_margin_s: float = 60.0, validate_interval_s: float = 300.0):
+        """
+        :param config_obj: An instance of APIConfig containing API configuration.
+        :param token: Optional; an existing API token to use. If provided, the class will not attempt to refresh the token.
+        :param limit: Optional; the maximum number of open connections of the shared transport.
+        :param limit_per_host: Optional; the maximum number of open connections per host (0 for no per host limit).
+        :param timeout: Optional; the default (connect, read) timeout of the shared transport in seconds.
+        :param refresh_margin_s: Optional; how long before the token expires it is refreshed.
+        :param validate_interval_s: Optional; see APIAuth.
+        """
+        self.API_TOKEN = token
+        self.api_config = config_obj
+        self.logger = logging.getLogger(__name__)
+        self._token_provided = token is not None
+        self.refresh_margin_s = refresh_margin_s
+        self.validate_interval_s = validate_interval_s
+
+        self._lock = asyncio.Lock()
+        self._generation = 0
+        self._issued_at = None
+        self._expires_at = None
+        self._observed_ttl = None
+        self._last_validated = 0.0
+        if token is not None:
+            self._set_token(token)
+
+        # every async API client shares this pooled transport via the AsyncAPIAuth object
+        self.transport = AsyncAPITransport(self, limit=limit, limit_per_host=limit_per_host, timeout=timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        await self.transport.close()
+
+    async def test_token(self) -> bool:
+        """
+        Test if the current API token is valid.
+
+        :return: True if the token is valid, False otherwise.
+        """
+        if self.API_TOKEN is None:
+            return False
+        api_response = await self.transport.get(
+            self.api_config.get_api_url() + "greetings/isloggedin",
+            authenticate=False,
+            headers={"Authorization": "Bearer " + self.API_TOKEN}
+        )
+
+        return api_response.status_code not in (401, 403)
+
+    async def refresh_token(self, stale_token: str = None) -> str | None:
+        """
+        Refresh the access token by authenticating with the API using username and password, see APIAuth.refresh_token
+
+        :param stale_token: Optional; the token the API just rejected.
+        :return: The new API token as a string if successful, None otherwise.
+        """
+        generation = self._generation
+        async with self._lock:
+            if stale_token is not None and self.API_TOKEN is not None and self.API_TOKEN != stale_token:
+                return self.API_TOKEN
+            if self._generation != generation and self.API_TOKEN is not None:
+                return self.API_TOKEN
+            if stale_token is not None and stale_token == self.API_TOKEN:
+                self._observe_rejection()
+            return await self._refresh_token()
+
+    async def get_token(self, refresh_if_expired=False) -> str | None:
+        """
+        Get the access token for the API, see APIAuth.get_token
+
+        :param refresh_if_expired: Boolean indicating whether to check if the token has expired (makes an extra API call).
+        :return: The API token as a string.
+        """
+        if self._token_provided:
+            if self.API_TOKEN is None:
+                self.logger.error("No API token available.")
+            return self.API_TOKEN
+
+        if not self._needs_refresh(refresh_if_expired):
+            return self.API_TOKEN
+
+        async with self._lock:
+            # another coroutine may have refreshed the token while we waited for the lock
+            if not self._needs_refresh(refresh_if_expired):
+                return self.API_TOKEN
+
+            if self.API_TOKEN is not None and self._expires_at is None:
+                self._last_validated = time.time()
+                if await self.test_token():
+                    return self.API_TOKEN
+                self._observe_rejection()
+
+            return await self._refresh_token()
+
+    async def _refresh_token(self) -> str | None:
+        """Get a new token from the API (the caller holds the lock)"""
+        uri = "{0}authentication/g?username={1}&password={2}".format(
+            self.api_config.get_api_url(),
+            self.api_config.get_api_username(),
+            self.api_config.get_api_password()
+        )
+        uri = r_utils.requote_uri(uri)
+        api_response = await self.transport.get(uri, authenticate=False)
+
+        if api_response.status_code == 200:
+            self._set_token(api_response.content.decode())
+            return self.API_TOKEN
+        else:
+            # e.g. 401 / 403 for bad credentials, or the 429 / 5xx the transport gave up on,
+            # the body is an error message, not a token
+            self.logger.error("Could not get an access token from the API. Response code was: {}"
+                              .format(api_response.status_code))
+            return None
+
+
+class AsyncSensorDataQuery:
+    """
+    asyncio counterpart of SensorDataQuery
+    """
+
+    # the URL and result handling are shared with SensorDataQuery
+    _prepare_url = SensorDataQuery._prepare_url
+    _format_block = staticmethod(SensorDataQuery._format_block)
+
+    def __init__(self, api_auth: AsyncAPIAuth):
+        self.api_auth = api_auth
+        self.logger = logging.getLogger(__name__)
+
+    async def get_data(self, mac: int,
+                       begin: int,
+                       end: int,
+                       types: list = [],
+                       columnar: bool = False,
+                       as_frame: bool = False,
+                       **query_args) -> list[SensorDatum] | SensorDataBlock | pd.DataFrame | None:
+        """
+        Query the sensordata/byrange endpoint, see SensorDataQuery.get_data for the parameters and the result
+
+        :param query_args - any of the other get_data query options (limit, down_sample, iq_range, etc.)
+        """
+        url = self._prepare_url(mac, begin, end, types, **query_args)
+
+        headers = {"X-AIR-Token": str(mac)}
+
+        response = await self.api_auth.transport.get(url, headers=headers)
+
+        if response.status_code == 200:
+
+            mac_rcvd = int(response.headers['X-AIR-Token'])
+
+            if columnar or as_frame:
+                return self._format_block(json_codec.decode_sensor_block(response.content, mac=mac_rcvd), True, as_frame)
+
+            json_response = json_codec.loads(response.content)
+
+            return [
+                SensorDatum(mac_rcvd, sensor_datum.get('type'), sensor_datum.get('timestamp'), sensor_datum.get('data'))
+                for sensor_datum in json_response
+            ]
+
+        else:
+            self.logger.warning("Invalid response code:{}".format(response.status_code))
+            return None
+
+    async def get_data_many(self, macs: list[int],
+                            begin: int,
+                            end: int,
+                            types: list = [],
+                            max_concurrency: int = 64,
+                            columnar: bool = False,
+                            as_frame: bool = False,
+                            **query_args) -> MultiMacQueryResult:
+        """
+        Run the same query for many MACs concurrently on the event loop, see SensorDataQuery.get_data_many
+
+        :param max_concurrency - the maximum number of MACs queried at the same time
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def query(mac: int):
+            async with semaphore:
+                return await self.get_data(mac, begin, end, types, columnar=columnar, as_frame=as_frame, **query_args)
+
+        results = await asyncio.gather(*[query(mac) for mac in macs], return_exceptions=True)
+
+        data = {}
+        errors = {}
+
+        for mac, mac_data in zip(macs, results):
+            if isinstance(mac_data, Exception):
+                self.logger.warning("Query for mac:{} failed: {}".format(mac, mac_data))
+                errors[mac] = str(mac_data)
+            elif mac_data is None:
+                errors[mac] = "Invalid response from the API"
+            else:
+                data[mac] = mac_data
+
+        return MultiMacQueryResult(data=data, errors=errors)
+
+
+class AsyncSensorDataIngest:
+    """
+    asyncio counterpart of the SensorDataIngest batch method
+    """
+
+    # serialization and compression are shared with SensorDataIngest
+    _serialize_data = staticmethod(SensorDataIngest._serialize_data)
+    _encode = SensorDataIngest._encode
+
+    def __init__(self, api_auth: AsyncAPIAuth,
+                 compression: str = None,
+                 max_batch_bytes: int = None,
+                 compression_level: int = None):
+        """
+        See SensorDataIngest for the parameters
+        """
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError("Unsupported compression: {}".format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package (pip install zstandard)")
+
+        self.api_auth = api_auth
+        self.compression = compression
+        self.compression_level = compression_level
+        self.max_batch_bytes = max_batch_bytes
+        self.logger = logging.getLogger(__name__)
+
+    async def send_data(self, data: list[dict], auth_check=False) -> bool:
+        """
+        Send several sensor data readings to the API (batch method)
+
+        :param data: a list of dicts where each dict must be in the form of:
+        { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 }
+        :param auth_check: whether to perform an authentication check to ensure we have a valid token
+        :return: True if success, False if otherwise
+        """
+        return await self._post_items(self._serialize_data(data), auth_check)
+
+    async def _post_items(self, items: list[str], auth_check: bool = False) -> bool:
+        """
+        Send serialized readings, splitting them into several requests if the body is over max_batch_bytes
+        """
+        if len(items) == 0:
+            return True
+
+        body = self._encode(items)
+
+        if self.max_batch_bytes is None or len(body) <= self.max_batch_bytes or len(items) == 1:
+            return await self._post_batch(body, len(items), auth_check)
+
+        n_parts = min(math.ceil(len(body) / self.max_batch_bytes), len(items))
+        part_size = math.ceil(len(items) / n_parts)
+
+        results = await asyncio.gather(*[
+            self._post_items(items[start:start + part_size], auth_check) for start in range(0, len(items), part_size)
+        ])
+        return all(results)
+
+    async def _post_batch(self, body: bytes, n_readings: int, auth_check: bool = False) -> bool:
+        """
+        POST an encoded batch to the batch endpoint (the transport retries it if the server didn't process it)
+        """
+        headers = {
+            'Content-type': 'application/json'
+        }
+        if self.compression is not None:
+            headers['Content-Encoding'] = self.compression
+
+        # note that batch endpoint is always secured
+        url = self.api_auth.api_config.get_api_url() + "ingest/std/batch"
+
+        try:
+            response = await self.api_auth.transport.post(url, refresh_if_expired=auth_check,
+                                                          headers=headers, data=body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.warning("Exception sending batch of {} readings: {}".format(n_readings, e))
+        else:
+            if response.status_code == 200:
+                json_response = json_codec.loads(response.content)
+                self.logger.debug("API Response:{0}".format(json_response))
+                if json_response['booleanResponse']:
+                    return True
+            else:
+                self.logger.warning("Invalid response code:{0}".format(response.status_code))
+
+        self.logger.error("Could not send batch of {} readings ({} bytes)".format(n_readings, len(body)))
+        return False
+
+
+class AsyncAPICache:
+    """
+    asyncio counterpart of APICache
+    """
+
+    def __init__(self, api_auth: AsyncAPIAuth):
+        self.api_auth = api_auth
+        self.logger = logging.getLogger(__name__)
+
+    async def get_latest_data(self, macs: list):
+
+        base_url = self.api_auth.api_config.get_api_url() + "sensorreport/latest"
+
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+        response = await self.api_auth.transport.post(base_url, headers=headers, data=json_codec.dumps(macs))
+
+        if response.status_code == 200:
+            return json_codec.loads(response.content)
+
+        else:
+            self.logger.warning("Invalid response code:{}".format(response.status_code))
+            return None
+
+
+class AsyncSensorDataStreams:
+    """
+    asyncio counterpart of SensorDataWebsocket for many locations
+    Every location subscription is a websocket on one aiohttp session, all of them run on one event loop with a
+    single keepalive task pinging every open socket, instead of two threads per location
+    (the websockets have their own session, so they don't hold connections of the request pool)
+
+    MACs can be added to or removed from a location without reconnecting: removed MACs are filtered out on the
+    client and new ones are subscribed by re-sending the location request on the open socket
+
+    A socket closed by the server (or the network) is re-opened with backoff, or with reconnect=False the location
+    is unsubscribed and on_close is called
+
+    The message_callback is called with each datum dict (a coroutine function is awaited)
+    """
+
+    def __init__(self, api_auth: AsyncAPIAuth, message_callback, ping_interval: float = 10.0,
+                 url: str = SENSOR_DATA_EVENTS_URL,
+                 reconnect: bool = True,
+                 backoff_factor: float = 1.0,
+                 max_backoff: float = 60.0,
+                 on_close=None):
+        """
+        :param api_auth: the AsyncAPIAuth object
+        :param message_callback: called with each sensor datum, e.g. { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 }
+        :param ping_interval: the seconds between keepalive pings
+        :param url: the sensordataevents endpoint (the token is appended)
+        :param reconnect: re-open a location's websocket when it is closed by the server
+        :param backoff_factor: the base delay in seconds between reconnect attempts
+        :param max_backoff: the maximum delay in seconds between reconnect attempts
+        :param on_close: optional; called with the location id when its websocket closed and it was unsubscribed
+        (reconnect=False)
+        """
+        self.api_auth = api_auth
+        self.message_callback = message_callback
+        self.ping_interval = ping_interval
+        self.url = url
+        self.reconnect = reconnect
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.on_close = on_close
+        self.logger = logging.getLogger(__name__)
+
+        # location id -> [websocket, set of watched macs, receive / reconnect task]
+        self._streams = {}
+        self._locks = collections.defaultdict(asyncio.Lock)
+        self._keepalive_task = None
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def locations(self) -> list[str]:
+        return list(self._streams.keys())
+
+    def get_macs(self, location_id: str) -> set[int]:
+        stream = self._streams.get(location_id)
+        return set(stream[1]) if stream is not None else set()
+
+    async def subscribe(self, location_id: str, macs: list[int]):
+        """
+        Start watching macs at a location, opening the location's websocket if it isn't open yet
+
+        :param location_id: the location (owner) id of the devices
+        :param macs: the macs to add to the location's subscription
+        """
+        async with self._locks[location_id]:
+            stream = self._streams.get(location_id)
+
+            if stream is None:
+                ws = await self._connect()
+                stream = [ws, set(macs), None]
+                self._streams[location_id] = stream
+                try:
+                    await self._send_request(location_id)
+                except Exception:
+                    # don't leave an entry without a receive task behind
+                    del self._streams[location_id]
+                    await ws.close()
+                    raise
+                stream[2] = asyncio.create_task(self._run(location_id, stream))
+
+                if self._keepalive_task is None or self._keepalive_task.done():
+                    self._keepalive_task = asyncio.create_task(self._keepalive())
+                return
+
+            new_macs = set(macs) - stream[1]
+            if new_macs:
+                stream[1].update(new_macs)
+                # while the socket is down, the reconnect sends the whole request
+                if not stream[0].closed:
+                    await self._send_request(location_id)
+
+    async def unsubscribe(self, location_id: str, macs: list[int] = None):
+        """
+        Stop watching macs at a location, the websocket is closed once no macs are left
+
+        :param location_id: the location (owner) id of the devices
+        :param macs: the macs to remove, None for all of them
+        """
+        async with self._locks[location_id]:
+            stream = self._streams.get(location_id)
+            if stream is None:
+                return
+
+            if macs is not None:
+                stream[1].difference_update(macs)
+                if stream[1]:
+                    return
+
+            del self._streams[location_id]
+            stream[2].cancel()
+            await stream[0].close()
+
+    async def close(self):
+        """
+        Close every websocket and stop the keepalive task
+        """
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+
+        await asyncio.gather(*[self.unsubscribe(location_id) for location_id in list(self._streams.keys())])
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        return self.session
+
+    async def _connect(self) -> aiohttp.ClientWebSocketResponse:
+        """
+        Open a websocket with a current token
+
+        :raises ConnectionError: if no token could be acquired
+        """
+        token = await self.api_auth.get_token()
+        if token is None:
+            raise ConnectionError("Could not get an API token for the websocket")
+        return await self._get_session().ws_connect(self.url + token)
+
+    async def _send_request(self, location_id: str):
+        """the first message (and any re-subscription) is the location id followed by the macs to watch"""
+        ws, macs, _ = self._streams[location_id]
+        await ws.send_str(",".join([location_id] + [str(mac) for mac in sorted(macs)]))
+
+    async def _run(self, location_id: str, stream: list):
+        """
+        Receive the messages of a location, re-opening the websocket whenever it is closed until it is unsubscribed
+        """
+        attempt = 0
+        while True:
+            await self._receive(location_id, stream)
+
+            if self._streams.get(location_id) is not stream:
+                # unsubscribed
+                return
+
+            if not stream[0].closed:
+                # the receive loop stopped on an error but the socket is still open, keep reading it
+                continue
+
+            if not self.reconnect:
+                self.logger.warning("Web socket for location {} was closed, unsubscribing".format(location_id))
+                del self._streams[location_id]
+                if self.on_close is not None:
+                    result = self.on_close(location_id)
+                    if asyncio.iscoroutine(result):
+                        await result
+                return
+
+            while True:
+                delay = retry_delay(None, attempt, self.backoff_factor, self.max_backoff)
+                self.logger.warning("Web socket for location {} closed (code {}), reconnecting in {:.1f}s"
+                                    .format(location_id, stream[0].close_code, delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+
+                try:
+                    ws = await self._connect()
+                except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+                    self.logger.error("Could not reconnect the web socket for location {}: {}".format(location_id, e))
+                    continue
+
+                async with self._locks[location_id]:
+                    if self._streams.get(location_id) is not stream:
+                        await ws.close()
+                        return
+                    if not stream[0].closed:
+                        await stream[0].close()
+                    stream[0] = ws
+                    try:
+                        await self._send_request(location_id)
+                    except ConnectionError as e:
+                        self.logger.error("Could not subscribe location {}: {}".format(location_id, e))
+                        continue
+
+                self.logger.info("Web socket for location {} reconnected".format(location_id))
+                attempt = 0
+                break
+
+    async def _receive(self, location_id: str, stream: list):
+        ws, macs = stream[0], stream[1]
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+
+                try:
+                    data = json_codec.loads(message.data)
+                except Exception as e:
+                    self.logger.warning("Could not decode a message on location {}: {}".format(location_id, e))
+                    continue
+                if not isinstance(data, list):
+                    continue
+
+                for datum in data:
+                    if 'type' in datum and datum.get('mac') in macs:
+                        # a failing callback only loses its own datum, not the socket or the rest of the message
+                        try:
+                            result = self.message_callback(datum)
+                            if asyncio.iscoroutine(result):
+                                await result
+                        except asyncio.CancelledError:
+                            raise
+                        except Exception as e:
+                            self.logger.warning("Exception in the message callback: {}".format(e))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error("WS Error on location {}: {}".format(location_id, e))
+
+        self.logger.info("Web socket for location {} closed".format(location_id))
+
+    async def _keepalive(self):
+        # in order to keep the web sockets from closing, we need to ping them
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            for location_id, (ws, _, _) in list(self._streams.items()):
+                if not ws.closed:
+                    try:
+                        await ws.send_str("PING")
+                    except ConnectionError as e:
+                        self.logger.warning("Could not ping the web socket for location {}: {}".format(location_id, e))
@@ -1,21 +1,74 @@
+import base64
+import json
 import logging
-import requests
+import threading
+import time
 import requests.utils as r_utils
 from api_config import APIConfig
+from transport import APITransport
+
+
+def token_expiry(token: str) -> float | None:
+    """
+    Get the expiry time (unix epoch seconds) from the 'exp' claim of a JWT
+
+    :param token: the API token
+    :return: the expiry time, or None if the token isn't a JWT or has no 'exp' claim
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+
+    try:
+        payload = parts[1] + "=" * (-len(parts[1]) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+    except (ValueError, AttributeError):
+        return None
+
+    return float(exp) if isinstance(exp, (int, float)) else None
 
 
 class APIAuth:
-    def __init__(self, config_obj: APIConfig, token: str = None):
+    """
+    Manages the API token for all the API clients
+
+    The expiry of the token is tracked from its JWT 'exp' claim, or, for opaque tokens, from the lifetime
+    observed the last time a token was rejected, and the token is refreshed refresh_margin_s seconds before it
+    expires. Refreshes are single-flight, when several threads need a new token at the same time only one of
+    them goes to the API and the others use its result
+    """
+
+    def __init__(self, config_obj: APIConfig, token: str = None, pool_connections: int = 10, pool_maxsize: int = 10,
+                 refresh_margin_s: float = 60.0, validate_interval_s: float = 300.0):
         """
         Initialize the APIAuth object.
 
         :param config_obj: An instance of APIConfig containing API configuration.
         :param token: Optional; an existing API token to use. If provided, the class will not attempt to refresh the token.
+        :param pool_connections: Optional; the number of per-host connection pools kept by the shared transport.
+        :param pool_maxsize: Optional; the maximum number of keep-alive connections per host.
+        :param refresh_margin_s: Optional; how long before the token expires it is refreshed.
+        :param validate_interval_s: Optional; when the expiry of the token isn't known, get_token(refresh_if_expired=True)
+        checks the token with the API at most this often.
         """
         self.API_TOKEN = token
         self.api_config = config_obj
         self.logger = logging.getLogger(__name__)
         self._token_provided = token is not None
+        self.refresh_margin_s = refresh_margin_s
+        self.validate_interval_s = validate_interval_s
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._issued_at = None
+        self._expires_at = None
+        self._observed_ttl = None
+        self._last_validated = 0.0
+        if token is not None:
+            self._set_token(token)
+
+        # every API client shares this pooled transport via the APIAuth object
+        self.transport = APITransport(self, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
 
     def test_token(self) -> bool:
         """
@@ -25,8 +78,9 @@ class APIAuth:
         """
         if self.API_TOKEN is None:
             return False
-        api_response = requests.get(
+        api_response = self.transport.get(
             self.api_config.get_api_url() + "greetings/isloggedin",
+            authenticate=False,
             headers={"Authorization": "Bearer " + self.API_TOKEN}
         )
 
@@ -35,12 +89,30 @@ class APIAuth:
         else:
             return True
 
-    def refresh_token(self) -> str | None:
+    def refresh_token(self, stale_token: str = None) -> str | None:
         """
         Refresh the access token by authenticating with the API using username and password.
+        Concurrent calls collapse into one, a thread that waited while another thread refreshed gets that token
 
+        :param stale_token: Optional; the token the API just rejected, if the current token is already a different
+        one (another thread refreshed it) it is returned without going to the API
         :return: The new API token as a string if successful, None otherwise.
         """
+        generation = self._generation
+        with self._lock:
+            if stale_token is not None and self.API_TOKEN is not None and self.API_TOKEN != stale_token:
+                return self.API_TOKEN
+            if self._generation != generation and self.API_TOKEN is not None:
+                # refreshed by another thread while we waited for the lock
+                return self.API_TOKEN
+            if stale_token is not None and stale_token == self.API_TOKEN:
+                self._observe_rejection()
+            return self._refresh_token()
+
+    def _refresh_token(self) -> str | None:
+        """
+        Get a new token from the API (the caller holds the lock)
+        """
         # Build the authentication URI
         uri = "{0}authentication/g?username={1}&password={2}".format(
             self.api_config.get_api_url(),
@@ -48,18 +120,58 @@ class APIAuth:
             self.api_config.get_api_password()
         )
         uri = r_utils.requote_uri(uri)
-        api_response = requests.get(uri)
+        api_response = self.transport.get(uri, authenticate=False)
 
-        if api_response.status_code in (401, 403):
-            self.logger.error("Could not get an access token from the API. Response code was: {}"
-                              .format(api_response.status_code))
-            return None
-        elif api_response.status_code >= 200:
-            self.API_TOKEN = api_response.content.decode()
+        if api_response.status_code == 200:
+            self._set_token(api_response.content.decode())
             return self.API_TOKEN
         else:
+            # e.g. 401 / 403 for bad credentials, or the 429 / 5xx the transport gave up on,
+            # the body is an error message, not a token
+            self.logger.error("Could not get an access token from the API. Response code was: {}"
+                              .format(api_response.status_code))
             return None
 
+    def _set_token(self, token: str):
+        """
+        Store a new token and work out when it expires
+        """
+        self.API_TOKEN = token
+        self._generation += 1
+        self._issued_at = time.time()
+        self._last_validated = self._issued_at
+
+        self._expires_at = token_expiry(token)
+        if self._expires_at is None and self._observed_ttl is not None:
+            self._expires_at = self._issued_at + self._observed_ttl
+
+    def _observe_rejection(self):
+        """
+        The current token was rejected, remember how long it lasted as the lifetime of opaque tokens
+        """
+        if self._issued_at is None or token_expiry(self.API_TOKEN) is not None:
+            return
+
+        ttl = time.time() - self._issued_at
+        # a token rejected almost straight away was rejected for some other reason than its age
+        if ttl > 2 * self.refresh_margin_s:
+            self._observed_ttl = ttl
+            self.logger.info("Token rejected after {:.0f}s, refreshing tokens before that from now on".format(ttl))
+
+    def _needs_refresh(self, refresh_if_expired: bool) -> bool:
+        """
+        Whether the current token is missing, about to expire or (if its expiry isn't known and
+        refresh_if_expired is set) due to be checked with the API
+        """
+        if self.API_TOKEN is None:
+            return True
+
+        now = time.time()
+        if self._expires_at is not None:
+            return now >= self._expires_at - self.refresh_margin_s
+
+        return refresh_if_expired and now - self._last_validated >= self.validate_interval_s
+
     def get_token(self, refresh_if_expired=False) -> str | None:
         """
         Get the access token for the API.
@@ -67,7 +179,11 @@ class APIAuth:
         If a token was provided during initialization, this method will return that token and will not attempt
         to refresh it.
 
-        :param refresh_if_expired: Boolean indicating whether to check if the token has expired (makes an extra API call).
+        A token that is about to expire is always refreshed first (no extra API call is needed for that when
+        its expiry is known).
+
+        :param refresh_if_expired: Boolean indicating whether to check if the token has expired when its expiry
+        isn't known (makes an extra API call, at most once every validate_interval_s).
         :return: The API token as a string.
         """
         if self._token_provided:
@@ -76,11 +192,18 @@ class APIAuth:
                 return None
             return self.API_TOKEN
 
-        if refresh_if_expired and not self.test_token():
-            return self.refresh_token()
-
-        if self.API_TOKEN is None:
-            # Try to get a new token
-            return self.refresh_token()
-        else:
+        if not self._needs_refresh(refresh_if_expired):
             return self.API_TOKEN
+
+        with self._lock:
+            # another thread may have refreshed the token while we waited for the lock
+            if not self._needs_refresh(refresh_if_expired):
+                return self.API_TOKEN
+
+            if self.API_TOKEN is not None and self._expires_at is None:
+                self._last_validated = time.time()
+                if self.test_token():
+                    return self.API_TOKEN
+                self._observe_rejection()
+
+            return self._refresh_token()
@@ -1,7 +1,6 @@
 import logging
 from typing import Optional, List
-import requests
-import json
+import json_codec
 from auth import APIAuth
 from entities import BuildingMap, Point
 
@@ -30,11 +29,10 @@ class BuildingMapAPIClient:
             bool: True if creation is successful, False otherwise.
         """
         url = self.api_auth.api_config.get_api_url() + "buildingmaps/create"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
-        response = requests.post(url, headers=headers, json=building_map.to_dict())
+        response = self.api_auth.transport.post(url, json=building_map.to_dict())
 
         if response.status_code == 200:
-            data = json.loads(response.content.decode())
+            data = json_codec.loads(response.content)
             return data.get("success", False)
         else:
             self.logger.warning("Failed to create building map: " + str(response.status_code))
@@ -51,11 +49,10 @@ class BuildingMapAPIClient:
             bool: True if update is successful, False otherwise.
         """
         url = self.api_auth.api_config.get_api_url() + "buildingmaps/update"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
-        response = requests.post(url, headers=headers, json=building_map.to_dict())
+        response = self.api_auth.transport.post(url, json=building_map.to_dict())
 
         if response.status_code == 200:
-            data = json.loads(response.content.decode())
+            data = json_codec.loads(response.content)
             return data.get("success", False)
         else:
             self.logger.warning("Failed to update building map: " + str(response.status_code))
@@ -72,11 +69,10 @@ class BuildingMapAPIClient:
             bool: True if deletion is successful, False otherwise.
         """
         url = self.api_auth.api_config.get_api_url() + f"buildingmaps/delete?id={building_map_id}"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
 
         if response.status_code == 200:
-            data = json.loads(response.content.decode())
+            data = json_codec.loads(response.content)
             return data.get("success", False)
         else:
             self.logger.warning("Failed to delete building map: " + str(response.status_code))
@@ -93,11 +89,10 @@ class BuildingMapAPIClient:
             Optional[List[BuildingMap]]: A list of BuildingMap objects, or None if the request failed.
         """
         url = self.api_auth.api_config.get_api_url() + f"buildingmaps/list?locationId={location_id}"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
 
         if response.status_code == 200:
-            data = json.loads(response.content.decode())
+            data = json_codec.loads(response.content)
             return [BuildingMap.from_dict(bm) for bm in data]
         else:
             self.logger.warning("Failed to list building maps: " + str(response.status_code))
@@ -117,8 +112,7 @@ class BuildingMapAPIClient:
         url = (self.api_auth.api_config.get_api_url() +
                f"buildingmaps/getimage?bearerToken={self.api_auth.get_token()}&locationId={location_id}&mapId={map_id}")
 
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
 
         if response.status_code == 200:
             return response.content
@@ -143,11 +137,10 @@ class BuildingMapAPIClient:
         print(url)
 
         headers = {
-            "Authorization": "Bearer " + self.api_auth.get_token(),
             "Content-Type": "application/json"
         }
 
-        response = requests.post(url, headers=headers, json=[point.to_dict() for point in points])
+        response = self.api_auth.transport.post(url, headers=headers, json=[point.to_dict() for point in points])
 
         if response.status_code == 200:
             return response.content
@@ -0,0 +1,194 @@
+import collections
+import logging
+import threading
+import time
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "coalesce")
+
+
+class _Shard:
+    """The queue of one worker (the caller holds cond for everything but the callback)"""
+
+    def __init__(self, coalesce: bool):
+        self.cond = threading.Condition()
+        # coalesce: (mac, type) -> (datum, enqueued at), otherwise a FIFO of (datum, enqueued at)
+        self.items = collections.OrderedDict() if coalesce else collections.deque()
+        self.submitted = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.thread = None
+
+
+class CallbackDispatcher:
+    """
+    Runs a message callback on a pool of worker threads behind bounded queues, so a slow callback
+    (e.g. a model inference) doesn't hold up the thread receiving the messages
+
+    Datums are sharded over the workers by MAC, each worker handles its queue in order, so the datums of a
+    MAC are passed to the callback in the order they were submitted
+
+    When a worker's queue is full the overflow policy decides what happens:
+        block       - submit waits for room (back pressure on the receiving thread)
+        drop_oldest - the oldest queued datum is dropped
+        coalesce    - only the latest queued datum per (mac, type) is kept, a new datum replaces a queued one
+                      of the same mac and type at any time (and takes its place at the back of the queue, so
+                      the order of each mac is kept), and the oldest is dropped if the queue is full
+    """
+
+    def __init__(self, message_callback, workers: int = 4, queue_size: int = 10000, overflow: str = "block"):
+        """
+        :param message_callback: called with each datum, e.g. { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 }
+        :param workers: the number of worker threads
+        :param queue_size: the maximum number of queued datums per worker
+        :param overflow: one of OVERFLOW_POLICIES
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(OVERFLOW_POLICIES))
+
+        self.message_callback = message_callback
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.logger = logging.getLogger(__name__)
+
+        self._shards = [_Shard(overflow == "coalesce") for _ in range(workers)]
+        self._running = False
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        self._running = True
+        for i, shard in enumerate(self._shards):
+            if shard.thread is None or not shard.thread.is_alive():
+                shard.thread = threading.Thread(target=self._run, args=(shard,),
+                                                name="CallbackWorker-{}".format(i), daemon=True)
+                shard.thread.start()
+
+    def stop(self, drain: bool = True, timeout: float = None):
+        """
+        Stop the worker threads
+
+        :param drain: handle the queued datums before stopping, otherwise they are dropped (and counted)
+        :param timeout: the maximum seconds to wait for each worker
+        """
+        self._running = False
+        for shard in self._shards:
+            with shard.cond:
+                if not drain:
+                    shard.dropped += len(shard.items)
+                    shard.items.clear()
+                shard.cond.notify_all()
+
+        for shard in self._shards:
+            if shard.thread is not None and shard.thread is not threading.current_thread():
+                shard.thread.join(timeout)
+
+    def submit(self, datum: dict) -> bool:
+        """
+        Queue a datum for the callback (called from the receiving thread)
+
+        :return: False if the datum was dropped (the dispatcher is stopped)
+        """
+        shard = self._shards[hash(datum.get('mac')) % len(self._shards)]
+        now = time.monotonic()
+
+        with shard.cond:
+            shard.submitted += 1
+
+            if self.overflow == "coalesce":
+                key = (datum.get('mac'), datum.get('type'))
+                if key in shard.items:
+                    # the replaced datum's slot moves to the back, so the mac's other queued types stay ahead of it
+                    shard.items[key] = (datum, now)
+                    shard.items.move_to_end(key)
+                    shard.coalesced += 1
+                    return True
+                if len(shard.items) >= self.queue_size:
+                    shard.items.popitem(last=False)
+                    shard.dropped += 1
+                shard.items[key] = (datum, now)
+
+            else:
+                if len(shard.items) >= self.queue_size:
+                    if self.overflow == "block":
+                        while len(shard.items) >= self.queue_size and self._running:
+                            shard.cond.wait()
+                        if not self._running:
+                            shard.dropped += 1
+                            return False
+                    else:
+                        shard.items.popleft()
+                        shard.dropped += 1
+                shard.items.append((datum, now))
+
+            shard.cond.notify_all()
+
+        return True
+
+    @property
+    def pending(self) -> int:
+        """The number of queued datums"""
+        return sum(len(shard.items) for shard in self._shards)
+
+    def stats(self) -> dict:
+        """
+        The counters of all the workers
+
+        :return: a dict with the submitted, delivered, dropped, coalesced and errors counts, the number of
+        pending datums and the last / maximum lag (milliseconds from submit to the callback) over the workers
+        """
+        ret = {
+            "submitted": 0,
+            "delivered": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "pending": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0
+        }
+        for shard in self._shards:
+            with shard.cond:
+                ret["submitted"] += shard.submitted
+                ret["delivered"] += shard.delivered
+                ret["dropped"] += shard.dropped
+                ret["coalesced"] += shard.coalesced
+                ret["errors"] += shard.errors
+                ret["pending"] += len(shard.items)
+                ret["last_lag_ms"] = max(ret["last_lag_ms"], shard.last_lag_ms)
+                ret["max_lag_ms"] = max(ret["max_lag_ms"], shard.max_lag_ms)
+        return ret
+
+    def _run(self, shard: _Shard):
+        while True:
+            with shard.cond:
+                while len(shard.items) == 0 and self._running:
+                    shard.cond.wait()
+                if len(shard.items) == 0:
+                    return
+
+                if self.overflow == "coalesce":
+                    datum, enqueued_at = shard.items.popitem(last=False)[1]
+                else:
+                    datum, enqueued_at = shard.items.popleft()
+
+                # wake a submitter blocked on the full queue
+                shard.cond.notify_all()
+
+                lag_ms = (time.monotonic() - enqueued_at) * 1000
+                shard.last_lag_ms = lag_ms
+                shard.max_lag_ms = max(shard.max_lag_ms, lag_ms)
+
+            try:
+                self.message_callback(datum)
+            except Exception as e:
+                self.logger.warning("Exception in the message callback: {}".format(e))
+                with shard.cond:
+                    shard.errors += 1
+            else:
+                with shard.cond:
+                    shard.delivered += 1
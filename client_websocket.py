@@ -1,21 +1,67 @@
 from auth import APIAuth
-import json
-import time
+import json_codec
+import numpy as np
 import websocket
 import collections
 import threading
 import logging
 
+from callback_dispatcher import CallbackDispatcher
+from sensor_data_query import SensorDataQuery
+from transport import retry_delay
+from utils import Utils
+
+# the sensordataevents endpoint, the token is appended to the URL
+SENSOR_DATA_EVENTS_URL = "ws://iot.aretas.ca/sensordataevents/"
+
 
 class SensorDataWebsocket:
     """
     A class for instantiating and
+
+    If the connection drops, it is re-opened with (jittered exponential) backoff and, with backfill enabled,
+    the readings missed while disconnected are fetched with SensorDataQuery and passed to the message_callback
+    in timestamp order before the live messages resume
+
+    With workers set, the message_callback runs on a CallbackDispatcher worker pool instead of the websocket
+    thread, so a slow callback doesn't stall the socket (the datums of each mac are still handled in order)
+
+    For vectorized consumers, pass a MicroBatcher as the message_callback to get columnar batches instead of
+    one call per datum
     """
     def __init__(self, api_auth: APIAuth,
                  target_location_id: str,
                  target_macs: list,
                  message_callback,
-                 ws_trace_enable=False):
+                 ws_trace_enable=False,
+                 ping_interval: float = 10.0,
+                 url: str = SENSOR_DATA_EVENTS_URL,
+                 reconnect: bool = True,
+                 backoff_factor: float = 1.0,
+                 max_backoff: float = 60.0,
+                 backfill: bool = True,
+                 max_backfill_ms: int = 60 * 60 * 1000,
+                 workers: int = 0,
+                 queue_size: int = 10000,
+                 overflow: str = "block"):
+        """
+        :param api_auth: the APIAuth object
+        :param target_location_id: the location (owner) id of the devices
+        :param target_macs: the macs to watch
+        :param message_callback: called with each sensor datum, e.g. { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 }
+        :param ws_trace_enable: enable the websocket-client trace
+        :param ping_interval: the seconds between keepalive pings
+        :param url: the sensordataevents endpoint (the token is appended)
+        :param reconnect: re-open the websocket when it closes (until stop() is called)
+        :param backoff_factor: the base delay in seconds between reconnect attempts
+        :param max_backoff: the maximum delay in seconds between reconnect attempts
+        :param backfill: fetch the readings missed while disconnected after reconnecting
+        :param max_backfill_ms: the longest gap that is backfilled (the most recent part of a longer outage is fetched)
+        :param workers: the number of callback worker threads, 0 to call the message_callback on the websocket thread
+        :param queue_size: the maximum number of queued datums per worker
+        :param overflow: what to do when a worker's queue is full, "block", "drop_oldest" or "coalesce"
+        (keep only the latest datum per mac and type), see CallbackDispatcher
+        """
 
         self.api_auth = api_auth
         self.ws_thread = None
@@ -26,21 +72,72 @@ class SensorDataWebsocket:
         self._target_macs = target_macs
         self.logger = logging.getLogger(__name__)
         self._ws_trace_enable = ws_trace_enable
+        self.ping_interval = ping_interval
+        self.url = url
+        self.reconnect = reconnect
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.backfill = backfill
+        self.max_backfill_ms = max_backfill_ms
+        self.sensor_data_query = SensorDataQuery(api_auth)
 
-        self._ws_ping_thread_run = False;
+        self.dispatcher = CallbackDispatcher(message_callback, workers, queue_size, overflow) if workers > 0 else None
+        self._deliver = self.dispatcher.submit if self.dispatcher is not None else message_callback
+
+        # the last timestamp delivered per (mac, type), where a backfill picks up from
+        self._last_seen = {}
+        # the newest backfilled timestamp per (mac, type), live messages up to it are duplicates
+        self._backfilled = {}
+        self._disconnected_at = None
+        self._reconnect_attempt = 0
+
+        # set by stop(), wakes the ping thread straight away instead of waiting out the ping interval
+        self._ws_stop = threading.Event()
 
     def ws_run(self, *args):
         # run it async so we don't block other processing
-        self.ws.run_forever()
+        while True:
+            self.ws.run_forever()
+
+            if self._ws_stop.is_set() or not self.reconnect:
+                break
+
+            if self._disconnected_at is None:
+                self._disconnected_at = Utils.now_ms()
+            if not self._wait_and_reconnect():
+                break
+
         self.logger.info("ws_run forever thread terminating")
 
+    def _wait_and_reconnect(self) -> bool:
+        """
+        Back off, then replace the closed websocket with a new one (with a current token)
+
+        :return: False if stop() was called while waiting
+        """
+        while True:
+            delay = retry_delay(None, self._reconnect_attempt, self.backoff_factor, self.max_backoff)
+            self.logger.warning("Web socket disconnected, reconnecting in {:.1f}s".format(delay))
+            if self._ws_stop.wait(delay):
+                return False
+
+            self._reconnect_attempt += 1
+            try:
+                self.ws = self._create_ws()
+            except Exception as e:
+                # e.g. no token could be acquired, keep backing off
+                self.logger.error("Could not reconnect the web socket: {}".format(e))
+                continue
+
+            return not self._ws_stop.is_set()
+
     def ws_run_ping(self):
         # in order to keep the web socket from closing, we need to ping it
-        while True:
-            if not self._ws_ping_thread_run:
-                return
-            time.sleep(10)
-            self.ws.send("PING")
+        while not self._ws_stop.wait(self.ping_interval):
+            try:
+                self.ws.send("PING")
+            except websocket.WebSocketException as e:
+                self.logger.warning("Could not ping the web socket: {}".format(e))
 
         self.logger.info("ws_run_ping terminating")
 
@@ -48,17 +145,23 @@ class SensorDataWebsocket:
         # url = self.api_auth.api_config.get_api_url() + "sensordata/byrange"
         # open the websocket and watch for messages
         websocket.enableTrace(self._ws_trace_enable)
-        self._ws_ping_thread_run = True
-        self.ws = websocket.WebSocketApp(
-            "ws://iot.aretas.ca/sensordataevents/" + self.api_auth.get_token(),
+        self._ws_stop.clear()
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        self.ws = self._create_ws()
+        x = threading.Thread(target=self.ws_run, args=())
+        x.start()
+        self.ws_thread = x
+
+    def _create_ws(self) -> websocket.WebSocketApp:
+        ws = websocket.WebSocketApp(
+            self.url + self.api_auth.get_token(),
             on_message=self.on_message,
             on_error=self.on_error,
             on_close=self.on_close
         )
-        self.ws.on_open = self.on_open
-        x = threading.Thread(target=self.ws_run, args=())
-        x.start()
-        self.ws_thread = x
+        ws.on_open = self.on_open
+        return ws
 
     def on_open(self, ws):
         """the aretas sensordataevents websocket-connection-example requires the first message
@@ -70,32 +173,114 @@ class SensorDataWebsocket:
         req_str = "{0},{1}".format(self._target_location_id, mac_str)
         self.ws.send(req_str)
 
-        x = threading.Thread(target=self.ws_run_ping, args=())
-        x.start()
-        # in case we need to access the thread
-        self.ws_ping_thread = x
+        self._reconnect_attempt = 0
+        if self._disconnected_at is not None:
+            self.logger.info("Web socket reconnected")
+            if self.backfill:
+                # the live messages are held back (this runs on the websocket thread) until the gap is filled
+                self._backfill_gap()
+            self._disconnected_at = None
+
+        if self.ws_ping_thread is None or not self.ws_ping_thread.is_alive():
+            x = threading.Thread(target=self.ws_run_ping, args=(), daemon=True)
+            x.start()
+            # in case we need to access the thread
+            self.ws_ping_thread = x
 
     def on_error(self, ws, error):
         self.logger.error("WS Error: {}".format(error))
 
     def on_close(self, ws, close_status_code, close_msg):
         self.logger.info("Web socket closed")
+        if self._disconnected_at is None and not self._ws_stop.is_set():
+            self._disconnected_at = Utils.now_ms()
 
     def on_message(self, ws, message):
         # print(message)
-        data = json.loads(message)
+        data = json_codec.loads(message)
         # print(type(data))
         # check if it is an array, list, etc.
         if isinstance(data, collections.abc.Sequence):
             for datum in data:
                 if 'type' in datum:
+                    key = (datum.get('mac'), datum['type'])
+                    timestamp = datum.get('timestamp')
+
+                    if self._backfilled:
+                        backfilled = self._backfilled.get(key)
+                        if backfilled is not None:
+                            if timestamp is not None and timestamp <= backfilled:
+                                # already delivered by the backfill
+                                continue
+                            del self._backfilled[key]
+
                     if self._ws_trace_enable:
                         self.logger.info("Received sensor data message:")
-                    self.message_callback(datum)
+                    self._deliver(datum)
 
-    def stop(self):
-        self._ws_ping_thread_run = False
-        self.ws_ping_thread.join()
-        self.ws.close()
+                    if timestamp is not None:
+                        self._last_seen[key] = timestamp
+
+    def _backfill_gap(self):
+        """
+        Fetch the readings of the target macs since they were last seen (or since the disconnect) and
+        pass them to the message_callback in timestamp order
+        """
+        now = Utils.now_ms()
+        earliest = now - self.max_backfill_ms
+        self._backfilled = {}
+
+        for mac in self._target_macs:
+            mac = int(mac)
+            seen = [timestamp for (seen_mac, _), timestamp in self._last_seen.items() if seen_mac == mac]
+            since = max(min(seen) if seen else self._disconnected_at, earliest)
+
+            try:
+                block = self.sensor_data_query.get_data(mac, since + 1, now, columnar=True, use_cache=False)
+            except Exception as e:
+                self.logger.error("Could not backfill mac {}: {}".format(mac, e))
+                continue
+
+            if block is None or len(block) == 0:
+                continue
 
+            order = np.argsort(block.timestamps, kind="stable")
+            n_delivered = 0
+            for i in order:
+                sensor_type = int(block.types[i])
+                timestamp = int(block.timestamps[i])
+                key = (mac, sensor_type)
+                if timestamp <= self._last_seen.get(key, since):
+                    continue
+
+                self._deliver({
+                    'mac': mac,
+                    'type': sensor_type,
+                    'timestamp': timestamp,
+                    'data': float(block.values[i])
+                })
+                self._last_seen[key] = timestamp
+                self._backfilled[key] = timestamp
+                n_delivered += 1
+
+            self.logger.info("Backfilled {} readings for mac {}".format(n_delivered, mac))
+
+    def stop(self):
+        self._ws_stop.set()
+        if self.ws_ping_thread is not None:
+            self.ws_ping_thread.join()
+        if self.ws is not None:
+            self.ws.close()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        close = getattr(self.message_callback, "close", None)
+        if callable(close):
+            # e.g. deliver the last partial batch of a MicroBatcher, finish writing a StreamRecorder
+            close()
 
+    def stats(self) -> dict | None:
+        """
+        The callback worker counters (submitted, delivered, dropped, coalesced, errors, pending and lag),
+        None if there are no workers
+        """
+        return self.dispatcher.stats() if self.dispatcher is not None else None
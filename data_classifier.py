@@ -3,8 +3,7 @@ import logging
 from requests import PreparedRequest
 
 from auth import APIAuth
-import requests
-import json
+import json_codec
 
 from utils import WebServiceBoolean
 from utils import Utils as AretasUtils
@@ -103,12 +102,11 @@ class DataClassifierCRUD:
         self.logger = logging.getLogger(__name__)
 
     def list(self) -> list[DataClassifier] | None:
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         url = self.api_auth.api_config.get_api_url() + "dataclassifier/list"
-        response = requests.get(url, headers=headers)
+        response = self.api_auth.transport.get(url)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             ret = [DataClassifierCRUD.unmarshall_api_json(item) for item in response_content]
             return ret
         else:
@@ -119,7 +117,6 @@ class DataClassifierCRUD:
 
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifier/create"
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
 
@@ -131,10 +128,10 @@ class DataClassifierCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.post(req.url, headers=headers, json=json_data)
+        response = self.api_auth.transport.post(req.url, headers=headers, json=json_data)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return AretasUtils.unmarshall_webservice_bool(response_content)
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -144,7 +141,6 @@ class DataClassifierCRUD:
 
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifier/delete"
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
 
@@ -155,10 +151,10 @@ class DataClassifierCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.post(req.url, headers=headers, json=json_data)
+        response = self.api_auth.transport.post(req.url, headers=headers, json=json_data)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return AretasUtils.unmarshall_webservice_bool(response_content)
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -168,7 +164,6 @@ class DataClassifierCRUD:
 
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifier/edit"
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
 
@@ -179,10 +174,10 @@ class DataClassifierCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.post(req.url, headers=headers, json=json_data)
+        response = self.api_auth.transport.post(req.url, headers=headers, json=json_data)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return AretasUtils.unmarshall_webservice_bool(response_content)
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
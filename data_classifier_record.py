@@ -1,7 +1,6 @@
-import json
+import json_codec
 import logging
 
-import requests
 from requests import PreparedRequest
 
 from auth import APIAuth
@@ -126,7 +125,6 @@ class DataClassifierRecordCRUD:
         Create a new DataClassifierRecord
         """
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifierrecord/save"
@@ -139,10 +137,10 @@ class DataClassifierRecordCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.post(req.url, headers=headers, json=json_data)
+        response = self.api_auth.transport.post(req.url, headers=headers, json=json_data)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return AretasUtils.unmarshall_webservice_bool(response_content)
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -154,7 +152,6 @@ class DataClassifierRecordCRUD:
         Delete an existing DataClassifierRecord
         """
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifierrecord/delete"
@@ -166,10 +163,10 @@ class DataClassifierRecordCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.post(req.url, headers=headers, json=json_data)
+        response = self.api_auth.transport.post(req.url, headers=headers, json=json_data)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return AretasUtils.unmarshall_webservice_bool(response_content)
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -180,7 +177,6 @@ class DataClassifierRecordCRUD:
         Purge all the records relating to a particular classifier ID
         """
         headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
             "Content-Type": "application/json"
         }
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifierrecord/purge"
@@ -192,10 +188,10 @@ class DataClassifierRecordCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url, headers=headers)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return AretasUtils.unmarshall_webservice_bool(response_content)
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -206,7 +202,6 @@ class DataClassifierRecordCRUD:
         Synonym for the REST API endpoint 'get/byid'
         Get all the data_classifier_records for a particular ID
         """
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifierrecord/get/byid"
 
         params = {
@@ -216,10 +211,10 @@ class DataClassifierRecordCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return [DataClassifierRecordCRUD.unmarshall_api_json(item) for item in response_content]
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -234,7 +229,6 @@ class DataClassifierRecordCRUD:
         Synonym for the REST API endpoint 'get/bymactimestamp'
         Query for dataclassifier records belonging to certain macs over certain timeframes
         """
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         base_url = self.api_auth.api_config.get_api_url() + "dataclassifierrecord/get/bymactimestamp"
 
         params = {
@@ -247,10 +241,10 @@ class DataClassifierRecordCRUD:
         req = PreparedRequest()
         req.prepare_url(base_url, params)
 
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             ret = [DataClassifierRecordCRUD.unmarshall_api_json(item) for item in response_content]
             return ret
         else:
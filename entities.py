@@ -1,5 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List, Optional
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel
 
 
@@ -237,9 +239,22 @@ class LocationSensorView:
 
 @dataclass
 class ClientLocationView:
+    """
+    All the locations, sensors and building maps of a client
+    Lookup indexes (mac / sensor id / location id / building map id) are built once when the view is created,
+    call build_indexes() again after changing the lists
+    """
     allMacs: List[int]
     id: str
     locationSensorViews: List[LocationSensorView]
+    _sensors_by_mac: dict = field(init=False, repr=False, compare=False)
+    _sensors_by_id: dict = field(init=False, repr=False, compare=False)
+    _location_views_by_id: dict = field(init=False, repr=False, compare=False)
+    _location_views_by_mac: dict = field(init=False, repr=False, compare=False)
+    _building_maps_by_id: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.build_indexes()
 
     @staticmethod
     def from_dict(data):
@@ -250,6 +265,40 @@ class ClientLocationView:
             locationSensorViews=locationSensorViews
         )
 
+    def build_indexes(self):
+        """
+        (Re)builds the lookup indexes, the first occurrence wins if an id appears more than once
+        """
+        self._sensors_by_mac = {}
+        self._sensors_by_id = {}
+        self._location_views_by_id = {}
+        self._location_views_by_mac = {}
+        self._building_maps_by_id = {}
+
+        for location_view in self.locationSensorViews:
+            self._location_views_by_id.setdefault(location_view.location.id, location_view)
+            for sensor in location_view.sensorList:
+                self._sensors_by_mac.setdefault(sensor.mac, sensor)
+                self._sensors_by_id.setdefault(sensor.id, sensor)
+                self._location_views_by_mac.setdefault(sensor.mac, location_view)
+            for building_map in location_view.buildingMapList:
+                self._building_maps_by_id.setdefault(building_map.id, building_map)
+
+    def get_sensor_by_mac(self, mac: int) -> Optional[Sensor]:
+        return self._sensors_by_mac.get(mac)
+
+    def get_sensor_by_id(self, sensor_id: str) -> Optional[Sensor]:
+        return self._sensors_by_id.get(sensor_id)
+
+    def get_location_view_by_id(self, location_id: str) -> Optional[LocationSensorView]:
+        return self._location_views_by_id.get(location_id)
+
+    def get_location_view_by_mac(self, mac: int) -> Optional[LocationSensorView]:
+        return self._location_views_by_mac.get(mac)
+
+    def get_building_map_by_id(self, building_map_id: str) -> Optional[BuildingMap]:
+        return self._building_maps_by_id.get(building_map_id)
+
 
 class WebServiceBoolean:
     """
@@ -276,13 +325,13 @@ class WebServiceBoolean:
         return self.message
 
 
-@dataclass
+@dataclass(slots=True)
 class SensorBit:
     timestamp: int
     data: float
 
 
-@dataclass
+@dataclass(slots=True)
 class SensorDataByType:
     sensor_type: int
     sensor_data: list[SensorBit]
@@ -291,8 +340,11 @@ class SensorDataByType:
 class SensorDatum:
     """
     The contract for a sensor data point from the API
+    Slotted (no per-instance __dict__) since queries can return millions of these
     """
 
+    __slots__ = ('__mac', '__data_type', '__timestamp', '__data')
+
     def __init__(self, mac: int = None, data_type: int = None, timestamp: int = None, data: float = None):
         self.__mac = mac
         self.__data_type = data_type
@@ -332,6 +384,260 @@ class SensorDatum:
         return self.__data
 
 
+@dataclass
+class SensorDataBlock:
+    """
+    A columnar block of sensor data points, one numpy array per field
+    Holding large query results this way avoids allocating a SensorDatum object per point
+
+    The column names follow the API contract: mac, type, timestamp, data
+    """
+    macs: np.ndarray
+    types: np.ndarray
+    timestamps: np.ndarray
+    values: np.ndarray
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return "SensorDataBlock({} points)".format(len(self))
+
+    def __getitem__(self, index):
+        """
+        block[i] is a SensorDatumView of row i, anything else (slice, mask, index array) selects a new block
+        """
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("SensorDataBlock index out of range")
+            return SensorDatumView(self, int(index))
+        return self.take(index)
+
+    def __iter__(self):
+        """
+        Iterates over the rows as SensorDatumViews
+        """
+        for index in range(len(self)):
+            yield SensorDatumView(self, index)
+
+    @classmethod
+    def empty(cls) -> 'SensorDataBlock':
+        """
+        Creates an empty SensorDataBlock
+        """
+        return cls(
+            macs=np.empty(0, dtype=np.int64),
+            types=np.empty(0, dtype=np.int32),
+            timestamps=np.empty(0, dtype=np.int64),
+            values=np.empty(0, dtype=np.float64)
+        )
+
+    @classmethod
+    def from_records(cls, records: list, mac: int = None) -> 'SensorDataBlock':
+        """
+        Creates a SensorDataBlock from a list of API datum dicts ({'type', 'timestamp', 'data'[, 'mac']})
+
+        Args:
+            records (list): the decoded datums
+            mac (int): the mac to use for every point, if None, the 'mac' key of each datum is used
+
+        Returns:
+            SensorDataBlock: the columnar block
+        """
+        n = len(records)
+        if mac is not None:
+            macs = np.full(n, mac, dtype=np.int64)
+        else:
+            macs = np.fromiter((r['mac'] for r in records), dtype=np.int64, count=n)
+
+        return cls(
+            macs=macs,
+            types=np.fromiter((r['type'] for r in records), dtype=np.int32, count=n),
+            timestamps=np.fromiter((r['timestamp'] for r in records), dtype=np.int64, count=n),
+            values=np.fromiter((r['data'] for r in records), dtype=np.float64, count=n)
+        )
+
+    @classmethod
+    def from_sensor_data(cls, sensor_data: list) -> 'SensorDataBlock':
+        """
+        Creates a SensorDataBlock from a list of SensorDatum objects
+        """
+        n = len(sensor_data)
+        return cls(
+            macs=np.fromiter((datum.get_mac() for datum in sensor_data), dtype=np.int64, count=n),
+            types=np.fromiter((datum.get_type() for datum in sensor_data), dtype=np.int32, count=n),
+            timestamps=np.fromiter((datum.get_timestamp() for datum in sensor_data), dtype=np.int64, count=n),
+            values=np.fromiter((datum.get_data() for datum in sensor_data), dtype=np.float64, count=n)
+        )
+
+    @classmethod
+    def concat(cls, blocks: list) -> 'SensorDataBlock':
+        """
+        Concatenates several SensorDataBlocks (in order) into one
+        """
+        blocks = [block for block in blocks if block is not None]
+        if len(blocks) == 0:
+            return cls.empty()
+
+        return cls(
+            macs=np.concatenate([block.macs for block in blocks]),
+            types=np.concatenate([block.types for block in blocks]),
+            timestamps=np.concatenate([block.timestamps for block in blocks]),
+            values=np.concatenate([block.values for block in blocks])
+        )
+
+    def take(self, index) -> 'SensorDataBlock':
+        """
+        Selects points from the block
+
+        Args:
+            index: a boolean mask, an integer index array or a slice
+
+        Returns:
+            SensorDataBlock: a new block containing only the selected points
+        """
+        return SensorDataBlock(
+            macs=self.macs[index],
+            types=self.types[index],
+            timestamps=self.timestamps[index],
+            values=self.values[index]
+        )
+
+    def sort_by_time(self, deduplicate: bool = True) -> 'SensorDataBlock':
+        """
+        Sorts the block by timestamp (then mac and type)
+
+        Args:
+            deduplicate (bool): whether to drop repeated points (same mac, type and timestamp), e.g. the
+            points on the shared edge of two adjacent query windows
+
+        Returns:
+            SensorDataBlock: a new, sorted block
+        """
+        order = np.lexsort((self.types, self.macs, self.timestamps))
+        block = self.take(order)
+
+        if deduplicate and len(block) > 1:
+            keep = np.ones(len(block), dtype=bool)
+            keep[1:] = ((block.timestamps[1:] != block.timestamps[:-1]) |
+                        (block.macs[1:] != block.macs[:-1]) |
+                        (block.types[1:] != block.types[:-1]))
+            block = block.take(keep)
+
+        return block
+
+    def to_sensor_data(self) -> list:
+        """
+        Converts the block to a list of SensorDatum objects
+        """
+        return [
+            SensorDatum(mac, data_type, timestamp, data) for mac, data_type, timestamp, data in zip(
+                self.macs.tolist(), self.types.tolist(), self.timestamps.tolist(), self.values.tolist()
+            )
+        ]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Converts the block to a pandas DataFrame with mac, type, timestamp and data columns
+        """
+        return pd.DataFrame({
+            "mac": self.macs,
+            "type": self.types,
+            "timestamp": self.timestamps,
+            "data": self.values
+        })
+
+
+class SensorDatumView:
+    """
+    A lightweight view of one row of a SensorDataBlock with the same accessors as SensorDatum
+    The values stay in the block's arrays (setters write through to them), the view only holds
+    the block and the row number
+    """
+
+    __slots__ = ('_block', '_index')
+
+    def __init__(self, block: SensorDataBlock, index: int):
+        self._block = block
+        self._index = index
+
+    def __repr__(self):
+        return "MAC: {} Type:{} Timestamp:{} Data:{}".format(
+            self.get_mac(),
+            self.get_type(),
+            self.get_timestamp(),
+            self.get_data()
+        )
+
+    def set_mac(self, mac: int):
+        self._block.macs[self._index] = mac
+
+    def get_mac(self) -> int:
+        return int(self._block.macs[self._index])
+
+    def set_type(self, data_type: int):
+        self._block.types[self._index] = data_type
+
+    def get_type(self) -> int:
+        return int(self._block.types[self._index])
+
+    def set_timestamp(self, timestamp: int):
+        self._block.timestamps[self._index] = timestamp
+
+    def get_timestamp(self) -> int:
+        return int(self._block.timestamps[self._index])
+
+    def set_data(self, data: float):
+        self._block.values[self._index] = data
+
+    def get_data(self) -> float:
+        return float(self._block.values[self._index])
+
+    def to_sensor_datum(self) -> SensorDatum:
+        """
+        Copies the row out to a standalone SensorDatum
+        """
+        return SensorDatum(self.get_mac(), self.get_type(), self.get_timestamp(), self.get_data())
+
+
+@dataclass
+class MultiMacQueryResult:
+    """
+    The result of a query fanned out over many MACs
+    data holds the query result for each MAC that succeeded, errors holds a reason for each MAC that failed
+    """
+    data: dict
+    errors: dict
+
+    def to_block(self) -> SensorDataBlock:
+        """
+        Combines the data for all the MACs into one SensorDataBlock (in MAC order)
+        """
+        blocks = []
+        for mac in sorted(self.data):
+            mac_data = self.data[mac]
+            if isinstance(mac_data, pd.DataFrame):
+                mac_data = SensorDataBlock(
+                    macs=mac_data['mac'].to_numpy(dtype=np.int64),
+                    types=mac_data['type'].to_numpy(dtype=np.int32),
+                    timestamps=mac_data['timestamp'].to_numpy(dtype=np.int64),
+                    values=mac_data['data'].to_numpy(dtype=np.float64)
+                )
+            elif not isinstance(mac_data, SensorDataBlock):
+                mac_data = SensorDataBlock.from_sensor_data(mac_data)
+            blocks.append(mac_data)
+
+        return SensorDataBlock.concat(blocks)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Combines the data for all the MACs into one pandas DataFrame with mac, type, timestamp and data columns
+        """
+        return self.to_block().to_frame()
+
+
 @dataclass
 class Point:
     """Represents a point with x, y and z coordinates."""
@@ -2,7 +2,6 @@ from auth import *
 from aretas_client import *
 from data_classifier import DataClassifierCRUD
 from data_classifier_record import DataClassifierRecord, DataClassifierRecordCRUD
-from entities import SensorDatum
 from sensor_data_query import SensorDataQuery
 from sensor_type_info import *
 import os
@@ -31,20 +30,25 @@ class DataClassifierRecordQueryTest:
     def fetch_classifier_record_data(self, data_classifier_record: DataClassifierRecord):
         """
         For each mac in assoc_macs, we're going to fetch the data from the API for the particular type
+        (the queries for each mac run concurrently)
         """
         sdq = SensorDataQuery(self.auth)
 
-        ret = {}
+        result = sdq.get_data_many(
+            macs=data_classifier_record.get_assoc_macs(),
+            begin=data_classifier_record.get_start_timestamp(),
+            end=data_classifier_record.get_end_timestamp(),
+            types=data_classifier_record.get_target_types(),
+            max_concurrency=8,
+            down_sample=False
+        )
+
+        for mac, error in result.errors.items():
+            print("Could not fetch data for mac:{} {}".format(mac, error))
 
-        for mac in data_classifier_record.assoc_macs:
-            record_data: list[SensorDatum] = sdq.get_data(
-                mac=mac,
-                begin=data_classifier_record.get_start_timestamp(),
-                end=data_classifier_record.get_end_timestamp(),
-                types=data_classifier_record.get_target_types(),
-                down_sample=False
-            )
+        ret = {}
 
+        for mac, record_data in result.data.items():
             if len(record_data) > 0:
                 ret[mac] = record_data
 
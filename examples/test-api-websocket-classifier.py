@@ -7,6 +7,7 @@ from labelled_data_query import LabelledDataQuery
 from sensor_type_info import *
 from utils import Utils as AUtils
 from client_websocket import SensorDataWebsocket
+from alignment import AlignmentEngine, AlignedBatch
 
 import pandas as pd
 
@@ -59,10 +60,6 @@ columns = sensor_type_info.get_labels(first_row_keys)
 columns.insert(0, 'timestamp')
 print(columns)
 
-# we stored the required types earlier in classifier_sensor_types
-# get a dict templated with the required types as keys with None placeholder values
-ingest_sensor_data = AUtils.get_dict_template(classifier_sensor_types)
-
 active_devices = client.get_active_devices()
 df_devices = pd.DataFrame(active_devices)
 
@@ -90,24 +87,27 @@ location_id = gym_device.iloc[0]["owner"]
 print(mac, location_id)
 
 
-def do_predict_one(data_df):
+def do_predict_many(data_df):
     # stub for a fake classifier
     print(data_df.head(1))
     pass
 
 
+def on_aligned(batch: AlignedBatch):
+    # get the dataframe (one row per aligned reading set) and call the prediction (depending on what the model expects)
+    do_predict_many(batch.to_frame(sensor_type_info))
+
+
+# the alignment engine keeps the latest reading of each required type for every mac, once a mac has all of them
+# time aligned, a row is emitted. rows are handed to on_aligned in batches (here every row, for one device)
+alignment_engine = AlignmentEngine(classifier_sensor_types, max_timestamp_diff=30000, batch_size=1,
+                                   on_batch=on_aligned)
+
+
 def process_message(sensor_datum):
-    global ingest_sensor_data
     print(sensor_datum)
-    # add the datum to the dict only after meeting numerous conditions
-    tmp = AUtils.add_sensor_datum(sensor_datum, mac, classifier_sensor_types, ingest_sensor_data)
-
-    # if the ingest_sensor_data dict now has all of our required data and is time_aligned
-    # we get the single row data frame and call the prediction (depending on what the model expects for input)
-    if AUtils.is_full_and_aligned(tmp):
-        # get the dataframe then massage it
-        df_datum = AUtils.get_datum_df(tmp, sensor_type_info)
-        do_predict_one(df_datum)
+    if sensor_datum['mac'] == mac:
+        alignment_engine.add_datum(sensor_datum)
 
 
 # we define the websocket stream the deviceids/macs we want to observe and the callback for message processing
@@ -118,3 +118,4 @@ stream.start()
 time.sleep(30)
 print("Stopping")
 stream.stop()
+alignment_engine.flush()
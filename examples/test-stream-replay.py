@@ -0,0 +1,79 @@
+import time
+
+from auth import *
+from aretas_client import *
+from alignment import AlignmentEngine, AlignedBatch
+from client_websocket import SensorDataWebsocket
+from sensor_data_query import SensorDataQuery
+from sensor_type_info import *
+from stream_replay import StreamRecorder, StreamReplayer
+from utils import Utils as AUtils
+
+import pandas as pd
+
+import os
+os.chdir('../')
+
+"""
+Benchmark a stream consumer (the classifier workflow from test-api-websocket-classifier.py) offline
+
+First we record a few minutes of live websocket data to a file, then we replay the recording into the same
+callback at real time, 10x and maximum speed and print the measured throughput and latency
+
+The same consumer can also be fed historical data pulled with SensorDataQuery
+"""
+config = APIConfig()
+auth = APIAuth(config)
+client = APIClient(auth)
+sensor_type_info = APISensorTypeInfo(auth)
+
+# the types our (mock) classifier needs, see test-api-websocket-classifier.py for getting them from labelled data
+classifier_sensor_types = [248, 181, 96]
+
+active_devices = client.get_active_devices()
+df_devices = pd.DataFrame(active_devices)
+
+# get the gym monitor
+gym_device = df_devices.loc[df_devices["description"] == "Gym"]
+mac = int(gym_device.iloc[0]["mac"])
+location_id = gym_device.iloc[0]["owner"]
+
+recording_path = "recordings/gym.stream"
+
+
+def do_predict_many(data_df):
+    # stub for a fake classifier
+    pass
+
+
+def on_aligned(batch: AlignedBatch):
+    do_predict_many(batch.to_frame(sensor_type_info))
+
+
+def new_consumer() -> AlignmentEngine:
+    """the consumer under test, a fresh one for each run"""
+    return AlignmentEngine(classifier_sensor_types, max_timestamp_diff=30000, batch_size=1, on_batch=on_aligned)
+
+
+# record the live stream (the recorder passes each datum on to the consumer, so the pipeline runs while recording)
+if not os.path.exists(recording_path):
+    live_consumer = new_consumer()
+    stream = SensorDataWebsocket(auth, location_id, [mac], StreamRecorder(recording_path, live_consumer.add_datum))
+    stream.start()
+
+    # record for 5 minutes
+    time.sleep(5 * 60)
+    stream.stop()
+
+# replay the recording at different speeds
+for speed in [1.0, 10.0, None]:
+    consumer = new_consumer()
+    stats = StreamReplayer(consumer.add_datum, speed=speed).replay_file(recording_path)
+    print("Speed: {0} {1} ({2} aligned rows)".format(speed if speed else "max", stats, consumer.rows_emitted))
+
+# or replay the last day of historical data as fast as the consumer keeps up
+now = AUtils.now_ms()
+consumer = new_consumer()
+stats = StreamReplayer(consumer.add_datum, speed=None).replay_query(
+    SensorDataQuery(auth), [mac], now - (24 * 60 * 60 * 1000), now, classifier_sensor_types)
+print("Historical: {0} ({1} aligned rows)".format(stats, consumer.rows_emitted))
@@ -1,6 +1,5 @@
 import logging
-import requests
-import json
+import json_codec
 from typing import Optional, Tuple
 from auth import APIAuth
 
@@ -34,15 +33,14 @@ class GeocodingAPIClient:
         """
         url = self.api_auth.api_config.get_api_url() + "geocoder/fromstring"
         headers = {
-            "Authorization": "Bearer " + self.api_auth.get_token(),
             "Content-Type": "application/json"
         }
 
         try:
             # The endpoint expects a JSON string in the request body.
-            response = requests.post(url, headers=headers, data=json.dumps(location_str))
+            response = self.api_auth.transport.post(url, headers=headers, data=json_codec.dumps(location_str))
             if response.status_code == 200:
-                data = response.json()
+                data = json_codec.loads(response.content)
                 # Assumes the returned JSON has "lat" and "lng" fields.
                 lat = data.get("lat")
                 lng = data.get("lng")
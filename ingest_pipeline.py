@@ -0,0 +1,190 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+from sensor_data_ingest import SensorDataIngest
+from utils import Utils as AUtils
+
+
+@dataclass
+class IngestPipelineStats:
+    """A snapshot of the IngestPipeline counters"""
+    queued: int
+    sent: int
+    failed: int
+    rejected: int
+    batches: int
+    queue_depth: int
+    readings_per_second: float
+    last_flush_ms: float
+
+
+class IngestPipeline:
+    """
+    Background batching for SensorDataIngest
+
+    Readings can be put from any thread into a bounded queue, worker threads pull them off and send them to the
+    batch endpoint (ingest/std/batch) whenever batch_size readings are waiting or the oldest waiting reading is
+    max_age_ms old. When the queue is full, put blocks (or times out) so producers are slowed down to the rate
+    the API can accept instead of buffering without bound
+    """
+
+    def __init__(self, ingest: SensorDataIngest,
+                 batch_size: int = 5000,
+                 max_age_ms: int = 1000,
+                 max_queue: int = 100000,
+                 n_workers: int = 2,
+                 auth_check: bool = False):
+        """
+        :param ingest: the SensorDataIngest object used to send the batches
+        :param batch_size: the maximum number of readings per batch
+        :param max_age_ms: the maximum time a reading waits in the queue before its batch is sent
+        :param max_queue: the maximum number of readings waiting in the queue
+        :param n_workers: the number of sending threads
+        :param auth_check: passed to SensorDataIngest.send_data
+        """
+        self.ingest = ingest
+        self.batch_size = batch_size
+        self.max_age_ms = max_age_ms
+        self.n_workers = n_workers
+        self.auth_check = auth_check
+        self.logger = logging.getLogger(__name__)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._workers = []
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+
+        self._queued = 0
+        self._sent = 0
+        self._failed = 0
+        self._rejected = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+        self._start_time = None
+
+    def start(self):
+        """Start the worker threads"""
+        self._stop_event.clear()
+        self._start_time = time.monotonic()
+        for i in range(self.n_workers):
+            worker = threading.Thread(target=self._run, name="IngestPipeline-{}".format(i), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float = None):
+        """
+        Stop the worker threads after the readings already in the queue have been sent
+
+        :param timeout: the maximum time to wait for each worker to finish
+        """
+        self._stop_event.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def put(self, datum: dict, block: bool = True, timeout: float = None) -> bool:
+        """
+        Queue a reading for sending
+
+        :param datum: a dict in the form { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 },
+        if the timestamp is missing, the time the reading was queued is used
+        :param block: whether to wait for room in the queue when it is full
+        :param timeout: the maximum time to wait for room in the queue
+        :return: True if the reading was queued, False if the queue was full
+        """
+        reading = {
+            'mac': int(datum['mac']),
+            'type': int(datum['type']),
+            'data': float(datum['data']),
+            'timestamp': int(datum['timestamp']) if 'timestamp' in datum else AUtils.now_ms()
+        }
+
+        try:
+            self._queue.put((time.monotonic(), reading), block=block, timeout=timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+
+        with self._stats_lock:
+            self._queued += 1
+        return True
+
+    def put_many(self, data: list[dict], block: bool = True, timeout: float = None) -> int:
+        """
+        Queue several readings for sending
+
+        :return: the number of readings queued
+        """
+        count = 0
+        for datum in data:
+            if not self.put(datum, block, timeout):
+                break
+            count += 1
+        return count
+
+    def stats(self) -> IngestPipelineStats:
+        """Get a snapshot of the pipeline counters"""
+        with self._stats_lock:
+            elapsed = time.monotonic() - self._start_time if self._start_time is not None else 0.0
+            return IngestPipelineStats(
+                queued=self._queued,
+                sent=self._sent,
+                failed=self._failed,
+                rejected=self._rejected,
+                batches=self._batches,
+                queue_depth=self._queue.qsize(),
+                readings_per_second=self._sent / elapsed if elapsed > 0 else 0.0,
+                last_flush_ms=self._last_flush_ms
+            )
+
+    def _run(self):
+        max_age = self.max_age_ms / 1000.0
+
+        while True:
+            try:
+                enqueued, reading = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return
+                continue
+
+            batch = [reading]
+            deadline = enqueued + max_age
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0 and not self._stop_event.is_set():
+                        _, reading = self._queue.get(timeout=remaining)
+                    else:
+                        _, reading = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(reading)
+
+            self._flush(batch)
+
+    def _flush(self, batch: list[dict]):
+        start = time.monotonic()
+
+        # retries are left to the transport, which knows when a batch can be re-sent safely
+        try:
+            success = self.ingest.send_data(batch, auth_check=self.auth_check)
+        except Exception as e:
+            self.logger.warning("Exception sending batch of {} readings: {}".format(len(batch), e))
+            success = False
+
+        with self._stats_lock:
+            self._batches += 1
+            self._last_flush_ms = (time.monotonic() - start) * 1000.0
+            if success:
+                self._sent += len(batch)
+            else:
+                self._failed += len(batch)
+
+        if not success:
+            self.logger.error("Could not send batch of {} readings to the API".format(len(batch)))
@@ -0,0 +1,351 @@
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from sensor_data_ingest import SensorDataIngest
+from utils import Utils as AUtils
+
+# mac, type, timestamp, data
+RECORD = struct.Struct('<qiqd')
+RECORD_DTYPE = np.dtype([('mac', '<i8'), ('type', '<i4'), ('timestamp', '<i8'), ('data', '<f8')])
+
+
+@dataclass
+class IngestSpoolStats:
+    """A snapshot of the IngestSpool counters"""
+    pending: int
+    appended: int
+    sent: int
+    dropped: int
+    segments: int
+    disk_bytes: int
+
+
+class IngestSpool:
+    """
+    A durable, disk backed write-ahead spool for sensor readings
+
+    Readings are appended to fixed size binary records in append-only segment files (fsync'd in batches) and a
+    background thread drains them to the batch endpoint (ingest/std/batch) in large batches whenever the API
+    can be reached, backing off while it can't. The drain position is checkpointed so a restart resumes where
+    it left off, and readings are sent in the order they were appended (so ordering per MAC is kept).
+    Delivery is at-least-once, a batch may be re-sent if the process stops between sending it and
+    checkpointing it
+
+    When the spool reaches max_disk_bytes the oldest segment is dropped to make room
+    """
+
+    def __init__(self, ingest: SensorDataIngest,
+                 directory: str,
+                 batch_size: int = 5000,
+                 segment_max_bytes: int = 16 * 1024 * 1024,
+                 max_disk_bytes: int = 1024 * 1024 * 1024,
+                 fsync_every: int = 1000,
+                 fsync_interval_ms: int = 1000,
+                 retry_interval_ms: int = 1000,
+                 max_retry_interval_ms: int = 60000):
+        """
+        :param ingest: the SensorDataIngest object used to send the batches
+        :param directory: the directory holding the segment files (created if it doesn't exist)
+        :param batch_size: the maximum number of readings sent per request
+        :param segment_max_bytes: the size at which a new segment file is started
+        :param max_disk_bytes: the maximum size of all the segment files together
+        :param fsync_every: fsync the active segment after this many appended readings
+        :param fsync_interval_ms: fsync the active segment at least this often when readings are being appended
+        :param retry_interval_ms: the initial wait before retrying after a failed send
+        :param max_retry_interval_ms: the maximum wait between retries
+        """
+        self.ingest = ingest
+        self.directory = directory
+        self.batch_size = batch_size
+        self.segment_max_bytes = segment_max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval_ms = fsync_interval_ms
+        self.retry_interval_ms = retry_interval_ms
+        self.max_retry_interval_ms = max_retry_interval_ms
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+        self._appended = 0
+        self._sent = 0
+        self._dropped = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+        self._checkpoint_path = os.path.join(directory, "checkpoint")
+        self._segments = deque()
+        self._sizes = dict()
+        self._recover()
+
+    def append(self, datum: dict):
+        """
+        Append a reading to the spool
+
+        :param datum: a dict in the form { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 },
+        if the timestamp is missing, the time the reading was appended is used
+        """
+        self.append_many([datum])
+
+    def append_many(self, data: list[dict]):
+        """
+        Append several readings to the spool
+        NaN / inf readings are dropped, they can't be sent to the API and would hold up the spool
+        """
+        now_ts = AUtils.now_ms()
+        records = []
+        n_dropped = 0
+        for datum in data:
+            value = float(datum['data'])
+            if not math.isfinite(value):
+                n_dropped += 1
+                continue
+            records.append(RECORD.pack(int(datum['mac']), int(datum['type']), int(datum.get('timestamp', now_ts)),
+                                       value))
+        payload = b"".join(records)
+
+        if n_dropped > 0:
+            self.logger.warning("Dropped {} readings with NaN / inf data".format(n_dropped))
+
+        segment_records = max(self.segment_max_bytes // RECORD.size, 1)
+
+        with self._lock:
+            position = 0
+            while position < len(payload):
+                room = segment_records * RECORD.size - self._sizes[self._active]
+                if room <= 0:
+                    self._rotate()
+                    self._enforce_disk_limit()
+                    continue
+
+                chunk = payload[position:position + room]
+                self._file.write(chunk)
+                self._sizes[self._active] += len(chunk)
+                position += len(chunk)
+
+            self._appended += len(records)
+            self._unsynced += len(records)
+            self._dropped += n_dropped
+
+            if self._unsynced >= self.fsync_every:
+                self._sync()
+
+            self._enforce_disk_limit()
+
+        self._wake_event.set()
+
+    def start(self):
+        """Start draining the spool to the API in the background"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="IngestSpool", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop the background drain and sync the spool to disk"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        """Stop draining and close the active segment"""
+        self.stop()
+        with self._lock:
+            self._file.close()
+
+    def drain(self) -> int:
+        """
+        Send everything in the spool to the API (in the calling thread) until it is empty or a send fails
+
+        :return: the number of readings sent
+        """
+        sent = 0
+        while True:
+            result = self._drain_once()
+            if result is None or result is False:
+                return sent
+            sent += result
+
+    def stats(self) -> IngestSpoolStats:
+        """Get a snapshot of the spool counters"""
+        with self._lock:
+            disk_bytes = sum(self._sizes.values())
+            consumed = self._checkpoint_offset if self._checkpoint_segment in self._sizes else 0
+            return IngestSpoolStats(
+                pending=(disk_bytes - consumed) // RECORD.size,
+                appended=self._appended,
+                sent=self._sent,
+                dropped=self._dropped,
+                segments=len(self._segments),
+                disk_bytes=disk_bytes
+            )
+
+    def _run(self):
+        backoff = self.retry_interval_ms
+        while not self._stop_event.is_set():
+            try:
+                result = self._drain_once()
+
+                with self._lock:
+                    if self._unsynced > 0 and (time.monotonic() - self._last_sync) * 1000 >= self.fsync_interval_ms:
+                        self._sync()
+            except Exception as e:
+                # keep the drain thread alive, back off as if the send failed
+                self.logger.error("Exception draining the spool: {}".format(e))
+                result = False
+
+            if result is False:
+                self._stop_event.wait(backoff / 1000.0)
+                backoff = min(backoff * 2, self.max_retry_interval_ms)
+                continue
+
+            backoff = self.retry_interval_ms
+            if result is None:
+                self._wake_event.wait(self.fsync_interval_ms / 1000.0)
+                self._wake_event.clear()
+
+    def _drain_once(self):
+        """
+        Send the next batch from the oldest segment
+
+        :return: the number of readings sent, None if there was nothing to send or False if the send failed
+        """
+        with self._lock:
+            segment = self._segments[0]
+            if segment == self._active:
+                self._file.flush()
+            size = self._sizes[segment]
+            offset = self._checkpoint_offset if self._checkpoint_segment == segment else 0
+
+            if offset >= size:
+                if segment == self._active:
+                    return None
+                # this segment has been sent completely
+                self._remove_segment(segment)
+                return 0
+
+            # read under the lock, _enforce_disk_limit may delete the segment as soon as it is released
+            length = min(self.batch_size * RECORD.size, size - offset)
+            with open(self._segment_path(segment), "rb") as segment_file:
+                segment_file.seek(offset)
+                records = np.frombuffer(segment_file.read(length), dtype=RECORD_DTYPE)
+
+        # segments written by older versions may hold NaN / inf readings, which send_arrays rejects
+        finite = np.isfinite(records['data'])
+        n_dropped = len(records) - int(np.count_nonzero(finite))
+        to_send = records[finite] if n_dropped > 0 else records
+
+        try:
+            success = len(to_send) == 0 or self.ingest.send_arrays(
+                to_send['mac'], to_send['type'], to_send['data'], to_send['timestamp'], chunk_size=len(to_send))
+        except Exception as e:
+            self.logger.warning("Exception sending spooled readings: {}".format(e))
+            success = False
+
+        if not success:
+            return False
+
+        if n_dropped > 0:
+            self.logger.warning("Dropped {} spooled readings with NaN / inf data".format(n_dropped))
+
+        with self._lock:
+            self._sent += len(to_send)
+            if segment in self._sizes:
+                self._dropped += n_dropped
+                self._write_checkpoint(segment, offset + len(records) * RECORD.size)
+            else:
+                # the segment was dropped to make room while the batch was being sent, and counted as dropped
+                self._dropped -= len(to_send)
+
+        return len(to_send)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, "{:012d}.seg".format(segment))
+
+    def _recover(self):
+        """Find the existing segments, trim any partially written record and load the checkpoint"""
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+        for segment in segments:
+            size = os.path.getsize(self._segment_path(segment))
+            if size % RECORD.size != 0:
+                size -= size % RECORD.size
+                with open(self._segment_path(segment), "r+b") as segment_file:
+                    segment_file.truncate(size)
+                self.logger.warning("Trimmed a partially written record from spool segment {}".format(segment))
+            self._segments.append(segment)
+            self._sizes[segment] = size
+
+        self._checkpoint_segment = -1
+        self._checkpoint_offset = 0
+        if os.path.exists(self._checkpoint_path):
+            with open(self._checkpoint_path, "r") as checkpoint_file:
+                segment, offset = checkpoint_file.read().split()
+                self._checkpoint_segment = int(segment)
+                self._checkpoint_offset = int(offset)
+
+        if len(self._segments) == 0:
+            self._segments.append(0)
+            self._sizes[0] = 0
+
+        self._active = self._segments[-1]
+        self._file = open(self._segment_path(self._active), "ab")
+
+    def _rotate(self):
+        """Close the active segment and start a new one (the caller holds the lock)"""
+        self._sync()
+        self._file.close()
+        self._active += 1
+        self._segments.append(self._active)
+        self._sizes[self._active] = 0
+        self._file = open(self._segment_path(self._active), "ab")
+
+    def _sync(self):
+        """Flush and fsync the active segment (the caller holds the lock)"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _enforce_disk_limit(self):
+        """Drop the oldest segments while the spool is over max_disk_bytes (the caller holds the lock)"""
+        while sum(self._sizes.values()) > self.max_disk_bytes and len(self._segments) > 1:
+            segment = self._segments[0]
+            consumed = self._checkpoint_offset if self._checkpoint_segment == segment else 0
+            dropped = (self._sizes[segment] - consumed) // RECORD.size
+            if dropped > 0:
+                self._dropped += dropped
+                self.logger.warning("Spool is full, dropping {} unsent readings (segment {})".format(dropped, segment))
+            self._remove_segment(segment)
+
+    def _remove_segment(self, segment: int):
+        """Delete a segment file (the caller holds the lock)"""
+        self._segments.remove(segment)
+        del self._sizes[segment]
+        os.remove(self._segment_path(segment))
+        if self._checkpoint_segment == segment:
+            self._write_checkpoint(-1, 0)
+
+    def _write_checkpoint(self, segment: int, offset: int):
+        """Persist the drain position (the caller holds the lock)"""
+        self._checkpoint_segment = segment
+        self._checkpoint_offset = offset
+        tmp_path = self._checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            checkpoint_file.write("{} {}".format(segment, offset))
+        os.replace(tmp_path, self._checkpoint_path)
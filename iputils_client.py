@@ -1,9 +1,9 @@
 import logging
-import requests
 from typing import Optional, Tuple
 
 from api_config import APIConfig
 from auth import APIAuth  # Assumes an APIAuth class is available for API configuration and token management
+import json_codec
 
 
 class IpUtilAPIClient:
@@ -29,12 +29,9 @@ class IpUtilAPIClient:
             Optional[str]: The client's IP address as a string if successful; otherwise, None.
         """
         url = self.api_auth.api_config.get_api_url() + "iputil/getip"
-        headers = {
-            "Authorization": "Bearer " + self.api_auth.get_token()
-        }
 
         try:
-            response = requests.get(url, headers=headers)
+            response = self.api_auth.transport.get(url)
             if response.status_code == 200:
                 # The endpoint returns a JSON string containing the IP address.
                 ip_address = response.text
@@ -55,14 +52,13 @@ class IpUtilAPIClient:
         """
         url = self.api_auth.api_config.get_api_url() + "iputil/getlocation"
         headers = {
-            "Authorization": "Bearer " + self.api_auth.get_token(),
             "Content-Type": "application/json"
         }
 
         try:
-            response = requests.get(url, headers=headers)
+            response = self.api_auth.transport.get(url, headers=headers)
             if response.status_code == 200:
-                data = response.json()
+                data = json_codec.loads(response.content)
                 # Expecting a JSON object with keys "lat" and "lng"
                 lat = data.get("lat")
                 lng = data.get("lng")
@@ -0,0 +1,108 @@
+import json
+from typing import Any
+
+import numpy as np
+from pydantic import TypeAdapter
+
+from entities import SensorDataBlock
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# the JSON library used for all API payloads, orjson and msgspec parse bytes directly and are several times
+# faster than the standard library, which is only used when neither is installed
+if orjson is not None:
+    BACKEND = "orjson"
+elif msgspec is not None:
+    BACKEND = "msgspec"
+else:
+    BACKEND = "json"
+
+if msgspec is not None:
+    class _SensorRecord(msgspec.Struct):
+        type: int
+        timestamp: int
+        data: float
+        mac: int = 0
+
+    _sensor_records_decoder = msgspec.json.Decoder(list[_SensorRecord])
+    _msgspec_decoder = msgspec.json.Decoder()
+    _msgspec_encoder = msgspec.json.Encoder()
+
+_type_adapters = {}
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    Parse a JSON document (e.g. response.content) without decoding it to a str first
+
+    :param data: the raw (utf-8) bytes or a str
+    :return: the decoded document
+    """
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if BACKEND == "msgspec":
+        return _msgspec_decoder.decode(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize an object to compact JSON bytes (e.g. for a request body)
+    """
+    if BACKEND == "orjson":
+        return orjson.dumps(obj)
+    if BACKEND == "msgspec":
+        return _msgspec_encoder.encode(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def decode_sensor_block(data: bytes, mac: int = None) -> SensorDataBlock:
+    """
+    Decode a sensordata query response ([{'type', 'timestamp', 'data'[, 'mac']}, ...]) into a SensorDataBlock
+
+    With msgspec the datums are decoded straight into typed structs, otherwise the parsed dicts
+    are copied into the columns
+
+    :param data: the raw response bytes
+    :param mac: the mac to use for every point, if None, the 'mac' of each datum is used
+    :return: the columnar block
+    """
+    if msgspec is None:
+        return SensorDataBlock.from_records(loads(data), mac=mac)
+
+    records = _sensor_records_decoder.decode(data)
+    n = len(records)
+
+    return SensorDataBlock(
+        macs=np.full(n, mac, dtype=np.int64) if mac is not None else
+        np.fromiter((r.mac for r in records), dtype=np.int64, count=n),
+        types=np.fromiter((r.type for r in records), dtype=np.int32, count=n),
+        timestamps=np.fromiter((r.timestamp for r in records), dtype=np.int64, count=n),
+        values=np.fromiter((r.data for r in records), dtype=np.float64, count=n)
+    )
+
+
+def decode_models(data: bytes, model_type: Any) -> Any:
+    """
+    Decode and validate a response straight into pydantic models, e.g. decode_models(content, list[Alert])
+    The bytes are parsed and validated in one pass by pydantic-core, no intermediate dicts are built
+
+    :param data: the raw response bytes
+    :param model_type: the pydantic model (or a list[...] / dict[...] of them)
+    :return: the validated model(s)
+    :raises pydantic.ValidationError: if the document doesn't match the models
+    """
+    adapter = _type_adapters.get(model_type)
+    if adapter is None:
+        adapter = TypeAdapter(model_type)
+        _type_adapters[model_type] = adapter
+
+    return adapter.validate_json(data)
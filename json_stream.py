@@ -0,0 +1,80 @@
+import codecs
+import json
+import re
+from typing import Iterable, Iterator
+
+_WHITESPACE = re.compile(r'\s*')
+# what may follow a number that was cut short at the end of a chunk
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
+    """
+    Incrementally parse a top level JSON array from an iterable of byte chunks
+    (e.g. requests.Response.iter_content) and yield each element as soon as it has been received
+
+    Only the current (partially received) element is held in memory, not the whole document
+
+    :param chunks: the raw (utf-8) bytes of the JSON document in any size chunks
+    :return: a generator of the decoded array elements
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    buf = ''
+    pos = 0
+    # 0 = expecting '[', 1 = expecting an element or ']', 2 = expecting ',' or ']', 3 = expecting an element
+    state = 0
+
+    for chunk in chunks:
+        buf = buf[pos:] + text_decoder.decode(chunk)
+        pos = 0
+
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+
+            char = buf[pos]
+
+            if state == 0:
+                if char != '[':
+                    raise ValueError("Expected a JSON array, got: {}".format(buf[pos:pos + 32]))
+                pos += 1
+                state = 1
+
+            elif state == 2:
+                if char == ',':
+                    pos += 1
+                    state = 3
+                elif char == ']':
+                    return
+                else:
+                    raise ValueError("Malformed JSON array near: {}".format(buf[pos:pos + 32]))
+
+            else:
+                if state == 1 and char == ']':
+                    return
+
+                try:
+                    element, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # the element is incomplete, wait for the next chunk
+                    break
+
+                if not isinstance(element, (dict, list)):
+                    # a scalar may still be truncated (e.g. 12 of 123, or 1 of 1.5 split after the '.'),
+                    # it is only complete once the ',' or ']' after it has been received
+                    delimiter = _WHITESPACE.match(buf, end).end()
+                    if delimiter >= len(buf):
+                        break
+                    if buf[delimiter] not in ',]':
+                        if _NUMBER_TAIL.fullmatch(buf, end):
+                            break
+                        raise ValueError("Malformed JSON array near: {}".format(buf[pos:pos + 32]))
+
+                yield element
+                pos = end
+                state = 2
+
+    raise ValueError("Truncated JSON array")
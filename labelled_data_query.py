@@ -1,9 +1,8 @@
 import logging
 
 from auth import APIAuth
-import requests
 from requests import PreparedRequest
-import json
+import json_codec
 
 
 class LabelledDataQuery:
@@ -51,7 +50,6 @@ class LabelledDataQuery:
         :return:
         """
 
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         base_url = self.api_auth.api_config.get_api_url() + "labelleddata/exportjson"
 
         params = {
@@ -82,10 +80,10 @@ class LabelledDataQuery:
         req.prepare_url(base_url, params)
         # print(req.url)
 
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url)
 
         if response.status_code == 200:
-            response_content = json.loads(response.content.decode())
+            response_content = json_codec.loads(response.content)
             return response_content
         else:
             self.logger.warning("Bad response code: " + str(response.status_code))
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from entities import SensorDataBlock
+
+
+class MicroBatcher:
+    """
+    Collects streamed datums into columnar batches for vectorized consumers
+
+    A MicroBatcher is a message callback (pass it as the message_callback of SensorDataWebsocket,
+    AsyncSensorDataStreams or a CallbackDispatcher), it buffers the datums in preallocated arrays and calls
+    batch_callback with a SensorDataBlock (or DataFrame) every batch_size datums, or max_delay_ms after the first
+    datum of a batch arrived, whichever comes first
+
+    The time based flushes happen on a background thread, so batch_callback may be called from either thread
+    (never concurrently)
+    """
+
+    def __init__(self, batch_callback,
+                 batch_size: int = 1000,
+                 max_delay_ms: int = 1000,
+                 types: list = None,
+                 as_frame: bool = False):
+        """
+        :param batch_callback: called with each batch
+        :param batch_size: the maximum number of datums per batch
+        :param max_delay_ms: the maximum time a datum waits in the buffer
+        :param types: optional; only datums of these sensor types are buffered
+        :param as_frame: deliver DataFrames (mac, type, timestamp, data columns) instead of SensorDataBlocks
+        """
+        self.batch_callback = batch_callback
+        self.batch_size = batch_size
+        self.max_delay_ms = max_delay_ms
+        self.types = frozenset(int(sensor_type) for sensor_type in types) if types is not None else None
+        self.as_frame = as_frame
+        self.logger = logging.getLogger(__name__)
+
+        self.batches = 0
+        self.filtered = 0
+
+        # _lock guards the buffers, _deliver_cond keeps the batches in order and batch_callback single threaded
+        self._lock = threading.Lock()
+        self._deliver_cond = threading.Condition()
+        self._taken = 0
+        self._delivered = 0
+        self._pending = threading.Event()
+        self._closed = threading.Event()
+        self._timer_thread = None
+        self._started_at = 0.0
+        self._allocate()
+
+    def __call__(self, datum: dict):
+        """
+        Buffer one datum ({ 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 })
+        """
+        sensor_type = int(datum['type'])
+        if self.types is not None and sensor_type not in self.types:
+            self.filtered += 1
+            return
+
+        batch = None
+        with self._lock:
+            n = self._n
+            self._macs[n] = datum['mac']
+            self._types[n] = sensor_type
+            self._timestamps[n] = datum['timestamp']
+            self._values[n] = datum['data']
+            self._n = n + 1
+
+            if self._n >= self.batch_size:
+                batch = self._take()
+            elif n == 0:
+                self._start_timer()
+
+        if batch is not None:
+            self._deliver(batch)
+
+    def flush(self):
+        """
+        Deliver the buffered datums now
+        """
+        with self._lock:
+            batch = self._take()
+        if batch is not None:
+            self._deliver(batch)
+
+    def close(self):
+        """
+        Deliver the buffered datums and stop the timer thread
+        """
+        self._closed.set()
+        self._pending.set()
+        if self._timer_thread is not None and self._timer_thread is not threading.current_thread():
+            self._timer_thread.join()
+        self.flush()
+
+    def _allocate(self):
+        self._macs = np.empty(self.batch_size, dtype=np.int64)
+        self._types = np.empty(self.batch_size, dtype=np.int32)
+        self._timestamps = np.empty(self.batch_size, dtype=np.int64)
+        self._values = np.empty(self.batch_size, dtype=np.float64)
+        self._n = 0
+        self._batch_id = getattr(self, "_batch_id", 0) + 1
+
+    def _take(self) -> tuple[SensorDataBlock, int] | None:
+        """Hand over the filled buffers with a sequence number and start new ones (the caller holds the lock)"""
+        n = self._n
+        if n == 0:
+            return None
+
+        block = SensorDataBlock(
+            macs=self._macs[:n],
+            types=self._types[:n],
+            timestamps=self._timestamps[:n],
+            values=self._values[:n]
+        )
+        self._allocate()
+        self._taken += 1
+        return block, self._taken - 1
+
+    def _deliver(self, batch: tuple[SensorDataBlock, int]):
+        block, sequence = batch
+        with self._deliver_cond:
+            # a batch taken by another thread just before this one goes first
+            while self._delivered != sequence:
+                self._deliver_cond.wait()
+
+            self.batches += 1
+            try:
+                self.batch_callback(block.to_frame() if self.as_frame else block)
+            except Exception as e:
+                self.logger.warning("Exception in the batch callback: {}".format(e))
+            finally:
+                self._delivered += 1
+                self._deliver_cond.notify_all()
+
+    def _start_timer(self):
+        """Wake the timer thread for the batch that was just started (the caller holds the lock)"""
+        if self._timer_thread is None:
+            self._timer_thread = threading.Thread(target=self._run_timer, name="MicroBatcherTimer", daemon=True)
+            self._timer_thread.start()
+        self._started_at = time.monotonic()
+        self._pending.set()
+
+    def _run_timer(self):
+        while True:
+            self._pending.wait()
+            if self._closed.is_set():
+                return
+
+            with self._lock:
+                self._pending.clear()
+                batch_id = self._batch_id
+                deadline = self._started_at + self.max_delay_ms / 1000
+
+            if self._closed.wait(max(deadline - time.monotonic(), 0)):
+                return
+
+            # only flush the batch the wait was started for, it may have been delivered by size already
+            with self._lock:
+                batch = self._take() if self._batch_id == batch_id else None
+            if batch is not None:
+                self._deliver(batch)
@@ -1,8 +1,8 @@
 import logging
 from typing import Optional, List
-import requests
 from pydantic import BaseModel
 from auth import APIAuth  # Assuming you have an APIAuth class for authentication
+import json_codec
 
 from pydantic import BaseModel, Field
 from typing import List
@@ -97,7 +97,6 @@ class ProbabilityServiceAPIClient:
             Optional[Histogram1DRecord]: The histogram data or None if the request failed.
         """
         url = self.api_auth.api_config.get_api_url() + "probability/univariatehistogram"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "startTime": start_time,
@@ -109,10 +108,10 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             print(data)
             histogram = Histogram1DRecord.parse_obj(data)
             return histogram
@@ -148,7 +147,6 @@ class ProbabilityServiceAPIClient:
             Optional[List[float]]: A list of density values or None if the request failed.
         """
         url = self.api_auth.api_config.get_api_url() + "probability/univariatehistodensity"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "X": X,
@@ -160,10 +158,10 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             return data  # Should be a list of floats
         else:
             self.logger.warning(
@@ -197,7 +195,6 @@ class ProbabilityServiceAPIClient:
             Optional[List[float]]: A list of probability values or None if the request failed.
         """
         url = self.api_auth.api_config.get_api_url() + "probability/univariatehistoprobability"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "X": X,
@@ -209,10 +206,10 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             return data  # Should be a list of floats
         else:
             self.logger.warning(
@@ -247,7 +244,6 @@ class ProbabilityServiceAPIClient:
             Optional[TemporalUnivariateHistogram]: The histogram data or None if the request failed.
         """
         url = self.api_auth.api_config.get_api_url() + "probability/temporalunivariatehisto"
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "startTime": start_time,
@@ -259,10 +255,10 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             histogram = TemporalUnivariateHistogram.parse_obj(data)
             return histogram
         else:
@@ -307,7 +303,6 @@ class ProbabilityServiceAPIClient:
                 self.api_auth.api_config.get_api_url()
                 + "probability/temporalunivariatehistodensity"
         )
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "X": X,
@@ -321,10 +316,10 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             return data  # Should be a list of floats
         else:
             self.logger.warning(
@@ -369,7 +364,6 @@ class ProbabilityServiceAPIClient:
                 self.api_auth.api_config.get_api_url()
                 + "probability/temporalunivariatehistoprobability"
         )
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "X": X,
@@ -383,10 +377,10 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             return data  # Should be a list of floats
         else:
             self.logger.warning(
@@ -428,7 +422,6 @@ class ProbabilityServiceAPIClient:
                 self.api_auth.api_config.get_api_url()
                 + "probability/temporalunivariateimage"
         )
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
         params = {
             "type": sensor_type,
             "startTime": start_time,
@@ -442,7 +435,7 @@ class ProbabilityServiceAPIClient:
         for mac in macs:
             params.setdefault("macs", []).append(mac)
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
 
         if response.status_code == 200:
             return response.content
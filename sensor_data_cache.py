@@ -0,0 +1,271 @@
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+
+from entities import SensorDataBlock
+from utils import Utils as AUtils
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class SensorDataCache:
+    """
+    A persistent, on-disk (SQLite) cache of raw sensor data for SensorDataQuery
+
+    Points are stored per MAC, type and timestamp and are tracked in (mac, type, day) partitions for eviction.
+    For each MAC and set of types the cache records which time ranges it already holds, so a query only
+    fetches the gaps from the API and reads everything else from disk
+
+    Only raw queries are cached, queries using server side processing (down sampling, moving averages,
+    outlier filtering, interpolation, indexes, offsets) depend on the whole query range and always go to the API
+    """
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 * 1024 * 1024, settle_ms: int = 10 * 60 * 1000):
+        """
+        :param path: the path to the cache database file (created if it doesn't exist)
+        :param max_bytes: the size the cache is trimmed back to (least recently used partitions are evicted first)
+        :param settle_ms: data newer than now - settle_ms is returned but not marked as covered, since late
+        readings may still arrive for it
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.settle_ms = settle_ms
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            # auto_vacuum only takes effect on a new database, it lets evictions actually shrink the file
+            self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS points ("
+                "mac INTEGER, type INTEGER, timestamp INTEGER, data REAL, "
+                "PRIMARY KEY (mac, type, timestamp)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS points_by_time ON points (mac, timestamp)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage (mac INTEGER, types TEXT, begin INTEGER, end INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS coverage_by_key ON coverage (mac, types)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS partitions ("
+                "mac INTEGER, type INTEGER, day INTEGER, last_access INTEGER, "
+                "PRIMARY KEY (mac, type, day))"
+            )
+
+    @staticmethod
+    def types_key(types: list) -> str:
+        """The coverage key for a set of types, '*' means all the types of the MAC"""
+        if not types:
+            return "*"
+        return ",".join(str(t) for t in sorted(set(int(t) for t in types)))
+
+    def get(self, mac: int, begin: int, end: int, types: list,
+            fetch: Callable[[int, int], Optional[SensorDataBlock]]) -> Optional[SensorDataBlock]:
+        """
+        Get the data for a query, fetching only the missing ranges
+
+        :param mac: the MAC address of the device
+        :param begin: the begin timestamp in unix epoch milliseconds (inclusive)
+        :param end: the end timestamp in unix epoch milliseconds (inclusive)
+        :param types: the sensor types (empty for all types)
+        :param fetch: called with (begin, end) for each missing range, must return the complete data
+        for that range as a SensorDataBlock, or None if it could not be fetched
+        :return: the data sorted by timestamp, or None if a missing range could not be fetched
+        """
+        key = self.types_key(types)
+        settled = AUtils.now_ms() - self.settle_ms
+
+        gaps = self.missing_ranges(mac, begin, end, types)
+        if len(gaps) > 0:
+            self.logger.info("Cache for mac:{} types:{} missing {} range(s)".format(mac, key, len(gaps)))
+
+        for gap_begin, gap_end in gaps:
+            block = fetch(gap_begin, gap_end)
+            if block is None:
+                return None
+
+            self.store(block)
+            if gap_begin <= settled:
+                self._add_coverage(mac, key, gap_begin, min(gap_end, settled))
+
+        block = self.read(mac, begin, end, types)
+        self._evict()
+        return block
+
+    def missing_ranges(self, mac: int, begin: int, end: int, types: list) -> list[tuple[int, int]]:
+        """
+        Get the (inclusive) sub ranges of [begin, end] that are not covered by the cache
+        Ranges cached for a superset of the types (or for all types, '*') also count as covered
+        """
+        key = self.types_key(types)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT types, begin, end FROM coverage WHERE mac = ? AND end >= ? AND begin <= ? ORDER BY begin",
+                (mac, begin, end)
+            ).fetchall()
+
+        if key != "*":
+            requested = set(key.split(","))
+            rows = [row for row in rows if row[0] == "*" or requested.issubset(row[0].split(","))]
+        else:
+            rows = [row for row in rows if row[0] == "*"]
+
+        gaps = []
+        cursor = begin
+        for _, covered_begin, covered_end in rows:
+            if covered_begin > cursor:
+                gaps.append((cursor, min(covered_begin - 1, end)))
+            cursor = max(cursor, covered_end + 1)
+            if cursor > end:
+                break
+
+        if cursor <= end:
+            gaps.append((cursor, end))
+
+        return gaps
+
+    def store(self, block: SensorDataBlock):
+        """
+        Write points to the cache (existing points are replaced)
+        """
+        if len(block) == 0:
+            return
+
+        days = block.timestamps // DAY_MS
+        partitions = np.unique(np.stack([block.macs, block.types.astype(np.int64), days], axis=1), axis=0)
+        now = AUtils.now_ms()
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO points (mac, type, timestamp, data) VALUES (?, ?, ?, ?)",
+                zip(block.macs.tolist(), block.types.tolist(), block.timestamps.tolist(), block.values.tolist())
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO partitions (mac, type, day, last_access) VALUES (?, ?, ?, ?)",
+                [(mac, sensor_type, day, now) for mac, sensor_type, day in partitions.tolist()]
+            )
+
+    def read(self, mac: int, begin: int, end: int, types: list) -> SensorDataBlock:
+        """
+        Read the cached points for a query, sorted by timestamp
+        """
+        sql = "SELECT type, timestamp, data FROM points WHERE mac = ? AND timestamp BETWEEN ? AND ?"
+        args = [mac, begin, end]
+        if types:
+            sql += " AND type IN ({})".format(",".join("?" * len(types)))
+            args.extend(int(t) for t in types)
+        sql += " ORDER BY timestamp, type"
+
+        with self._lock, self._conn:
+            rows = np.fromiter(
+                self._conn.execute(sql, args),
+                dtype=[('type', np.int32), ('timestamp', np.int64), ('data', np.float64)]
+            )
+            self._conn.execute(
+                "UPDATE partitions SET last_access = ? WHERE mac = ? AND day BETWEEN ? AND ?",
+                (AUtils.now_ms(), mac, begin // DAY_MS, end // DAY_MS)
+            )
+
+        return SensorDataBlock(
+            macs=np.full(len(rows), mac, dtype=np.int64),
+            types=rows['type'].copy(),
+            timestamps=rows['timestamp'].copy(),
+            values=rows['data'].copy()
+        )
+
+    def size_bytes(self) -> int:
+        """The number of bytes in use by the cache database"""
+        with self._lock:
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def clear(self):
+        """Remove everything from the cache"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM points")
+            self._conn.execute("DELETE FROM coverage")
+            self._conn.execute("DELETE FROM partitions")
+        with self._lock:
+            self._conn.execute("PRAGMA incremental_vacuum")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _add_coverage(self, mac: int, key: str, begin: int, end: int):
+        """Record [begin, end] as covered for the key, merging overlapping and adjacent ranges"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT begin, end FROM coverage WHERE mac = ? AND types = ? AND end >= ? AND begin <= ?",
+                (mac, key, begin - 1, end + 1)
+            ).fetchall()
+
+            for covered_begin, covered_end in rows:
+                begin = min(begin, covered_begin)
+                end = max(end, covered_end)
+
+            self._conn.execute(
+                "DELETE FROM coverage WHERE mac = ? AND types = ? AND end >= ? AND begin <= ?",
+                (mac, key, begin, end)
+            )
+            self._conn.execute(
+                "INSERT INTO coverage (mac, types, begin, end) VALUES (?, ?, ?, ?)", (mac, key, begin, end)
+            )
+
+    def _evict(self, batch_size: int = 32):
+        """Evict the least recently used partitions until the cache is under max_bytes"""
+        while self.size_bytes() > self.max_bytes:
+            with self._lock, self._conn:
+                partitions = self._conn.execute(
+                    "SELECT mac, type, day FROM partitions ORDER BY last_access LIMIT ?", (batch_size,)
+                ).fetchall()
+                if len(partitions) == 0:
+                    return
+
+                for mac, sensor_type, day in partitions:
+                    day_begin = day * DAY_MS
+                    day_end = day_begin + DAY_MS - 1
+                    self._conn.execute(
+                        "DELETE FROM points WHERE mac = ? AND type = ? AND timestamp BETWEEN ? AND ?",
+                        (mac, sensor_type, day_begin, day_end)
+                    )
+                    self._conn.execute(
+                        "DELETE FROM partitions WHERE mac = ? AND type = ? AND day = ?", (mac, sensor_type, day)
+                    )
+                    self._remove_coverage(mac, day_begin, day_end)
+
+                self.logger.info("Evicted {} partitions from the sensor data cache".format(len(partitions)))
+
+            with self._lock:
+                self._conn.execute("PRAGMA incremental_vacuum")
+
+    def _remove_coverage(self, mac: int, begin: int, end: int):
+        """Cut [begin, end] out of every covered range of the MAC (the caller holds the lock)"""
+        rows = self._conn.execute(
+            "SELECT rowid, types, begin, end FROM coverage WHERE mac = ? AND end >= ? AND begin <= ?",
+            (mac, begin, end)
+        ).fetchall()
+
+        for rowid, key, covered_begin, covered_end in rows:
+            self._conn.execute("DELETE FROM coverage WHERE rowid = ?", (rowid,))
+            if covered_begin < begin:
+                self._conn.execute(
+                    "INSERT INTO coverage (mac, types, begin, end) VALUES (?, ?, ?, ?)",
+                    (mac, key, covered_begin, begin - 1)
+                )
+            if covered_end > end:
+                self._conn.execute(
+                    "INSERT INTO coverage (mac, types, begin, end) VALUES (?, ?, ?, ?)",
+                    (mac, key, end + 1, covered_end)
+                )
@@ -1,6 +1,5 @@
 import logging
 from typing import Optional
-import requests
 
 from auth import APIAuth
 
@@ -75,8 +74,7 @@ class SensorDataChartImage:
             params["interpolateTimestep"] = interpolate_timestep
             params["interpolateType"] = interpolate_type
 
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token()}
-        response = requests.get(url, headers=headers, params=params)
+        response = self.api_auth.transport.get(url, params=params)
         if response.status_code == 200:
             return response.content
         else:
@@ -1,10 +1,22 @@
+import gzip
 import logging
+import math
 
 from auth import APIAuth
 from utils import Utils as AUtils
 import requests
 from requests.models import PreparedRequest
-import json
+import json_codec
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the batch endpoint's datum contract, floats use repr so they round trip exactly
+_BATCH_DATUM_FORMAT = '{{"mac":{},"type":{},"data":{!r},"timestamp":{}}}'.format
 
 
 class SensorDataIngest:
@@ -17,15 +29,35 @@ class SensorDataIngest:
         - extended types batch
     """
 
-    def __init__(self, api_auth: APIAuth):
+    def __init__(self, api_auth: APIAuth,
+                 compression: str = None,
+                 max_batch_bytes: int = None,
+                 compression_level: int = None):
+        """
+        :param api_auth: the APIAuth object
+        :param compression: None, 'gzip' or 'zstd' (requires the zstandard package) to compress batch request bodies
+        :param max_batch_bytes: batches whose request body (after compression) is larger than this are split
+        into several requests, None for no limit
+        :param compression_level: the compression level, None for the codec default
+        """
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError("Unsupported compression: {}".format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package (pip install zstandard)")
+
         self.api_auth = api_auth
+        self.compression = compression
+        self.compression_level = compression_level
+        self.max_batch_bytes = max_batch_bytes
         self.logger = logging.getLogger(__name__)
 
     def send_datum_auth_check(self, datum: dict, overwritetimestamp: bool = True, n_retries: int = 2) -> bool:
         """
         Send a datum using automatic auth token refresh
-        This method is a bit overkill since we can just pass in 'refresh_if_expired'
-        into the get_token method
+        This method is a bit overkill since the transport already refreshes the token and replays
+        the request when it is rejected
+
+        :param n_retries: no longer used, kept for compatibility (see APITransport for the retry policy)
         """
         ts = AUtils.now_ms()
 
@@ -47,29 +79,18 @@ class SensorDataIngest:
         req = PreparedRequest()
         req.prepare_url(url, params)
 
-        auth_token = self.api_auth.get_token(refresh_if_expired=True)
-        if auth_token is None:
-            """
-            This isn't ideal, but we'll let it slide for now until we decide what to do when a user has provided
-            invalid access credentials or the API is malfunctioning
-            """
-            auth_token = ""
-
-        headers = {"Authorization": "Bearer " + auth_token, "X-AIR-Token": str(mac)}
+        # if no token could be acquired the transport sends the request without one
+        # and refreshes the token when the API rejects it
+        headers = {"X-AIR-Token": str(mac)}
 
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url, refresh_if_expired=True, headers=headers)
 
         if response.status_code == 200:
 
-            json_response = json.loads(response.content.decode())
-            self.logger.info("API Response:{0}".format(json_response))
+            json_response = json_codec.loads(response.content)
+            self.logger.debug("API Response:{0}".format(json_response))
             return json_response['booleanResponse']
 
-        elif (response.status_code == 401 or response.status_code == 403) and (n_retries > 0):
-            self.logger.info("Response [{}], refreshing authtoken".format(response.status_code))
-            n_retries = n_retries - 1
-            self.api_auth.refresh_token()
-            return self.send_datum_auth_check(datum, overwritetimestamp, n_retries)
         else:
             self.logger.error("Could not send datum to API. Invalid response code:{}".format(response.status_code))
             return False
@@ -99,18 +120,18 @@ class SensorDataIngest:
         req = PreparedRequest()
         req.prepare_url(url, params)
 
-        headers = {"Authorization": "Bearer " + self.api_auth.get_token(), "X-AIR-Token": str(mac)}
+        headers = {"X-AIR-Token": str(mac)}
 
-        response = requests.get(req.url, headers=headers)
+        response = self.api_auth.transport.get(req.url, headers=headers)
 
         if response.status_code == 200:
 
-            json_response = json.loads(response.content.decode())
-            self.logger.info("API Response:{0}".format(json_response))
+            json_response = json_codec.loads(response.content)
+            self.logger.debug("API Response:{0}".format(json_response))
             return json_response['booleanResponse']
 
         else:
-            self.logger.error("Invalid response code:{0}".format(response.status_code))
+            self.logger.warning("Invalid response code:{0}".format(response.status_code))
             return False
 
     def send_data(self, data: list[dict], auth_check = False) -> bool:
@@ -122,42 +143,226 @@ class SensorDataIngest:
         :param auth_check: whether to perform an authentication check to ensure we have a valid token
         :return: True if success, False if otherwise
         """
+        return self._post_items(self._serialize_data(data), auth_check)
+
+    def send_arrays(self, macs, types, values, timestamps=None,
+                    chunk_size: int = 10000, auth_check: bool = False) -> bool:
+        """
+        Send sensor data readings held in columns (numpy arrays, lists, etc.) to the API (batch method)
+        The columns are validated and serialized in bulk, no per-reading dicts are created
+
+        :param macs: the MAC of each reading, or a single MAC for all of them
+        :param types: the sensor type of each reading, or a single type for all of them
+        :param values: the reading values
+        :param timestamps: the unix epoch millisecond timestamp of each reading, a single timestamp,
+        or None to use the current time
+        :param chunk_size: the maximum number of readings sent per request
+        :param auth_check: whether to perform an authentication check to ensure we have a valid token
+        :return: True if every chunk was accepted, False if otherwise
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        n = len(values)
+
+        if timestamps is None:
+            timestamps = AUtils.now_ms()
+
+        macs = self._as_int_column("macs", macs, n)
+        types = self._as_int_column("types", types, n)
+        timestamps = self._as_int_column("timestamps", timestamps, n)
+
+        if not np.all(np.isfinite(values)):
+            raise ValueError("values must be finite (NaN and inf can't be sent to the API)")
+
+        success = True
+        for start in range(0, n, chunk_size):
+            stop = start + chunk_size
+            items = self._serialize_rows(macs[start:stop], types[start:stop],
+                                         values[start:stop], timestamps[start:stop])
+            if not self._post_items(items, auth_check):
+                self.logger.error("Could not send readings {} to {}".format(start, min(stop, n) - 1))
+                success = False
+
+        return success
+
+    def send_frame(self, df: pd.DataFrame,
+                   mac_column: str = 'mac',
+                   type_column: str = 'type',
+                   value_column: str = 'data',
+                   timestamp_column: str = 'timestamp',
+                   chunk_size: int = 10000,
+                   auth_check: bool = False) -> bool:
+        """
+        Send the readings in a DataFrame to the API (batch method), see send_arrays
+
+        :param df: a DataFrame with (by default) mac, type, data and optionally timestamp columns,
+        the timestamp column can hold unix epoch milliseconds or datetimes
+        :return: True if every chunk was accepted, False if otherwise
+        """
+        timestamps = None
+        if timestamp_column in df.columns:
+            column = df[timestamp_column]
+            if pd.api.types.is_datetime64_any_dtype(column.dtype) or \
+                    pd.api.types.infer_dtype(column, skipna=True) in ('datetime', 'datetime64'):
+                # tz aware datetimes (also an object column of them) are converted to UTC, naive ones are taken as UTC
+                column = pd.to_datetime(column, utc=True)
+                timestamps = column.dt.tz_localize(None).to_numpy().astype('datetime64[ms]').astype(np.int64)
+            else:
+                timestamps = column.to_numpy()
+
+        return self.send_arrays(
+            df[mac_column].to_numpy(),
+            df[type_column].to_numpy(),
+            df[value_column].to_numpy(),
+            timestamps,
+            chunk_size=chunk_size,
+            auth_check=auth_check
+        )
+
+    @staticmethod
+    def _as_int_column(name: str, column, n: int) -> np.ndarray:
+        """
+        Validate a column (or scalar) and broadcast it to an int64 array of length n
+        """
+        column = np.asarray(column)
+        if column.ndim > 1:
+            column = column.ravel()
+
+        if column.ndim == 1 and len(column) != n:
+            raise ValueError("{} has {} entries, expected {}".format(name, len(column), n))
+
+        if not np.issubdtype(column.dtype, np.integer):
+            as_float = column.astype(np.float64)
+            if not np.all(np.isfinite(as_float)) or not np.all(np.mod(as_float, 1) == 0):
+                raise ValueError("{} must be whole numbers".format(name))
+
+        return np.broadcast_to(column.astype(np.int64), (n,))
+
+    @staticmethod
+    def _serialize_data(data: list[dict]) -> list[str]:
+        """
+        Serialize reading dicts to a list of readings in the batch endpoint's JSON contract
+        Readings without a timestamp are given the current time, NaN / inf readings are dropped
+        (they aren't valid JSON and would get the whole batch rejected)
+        """
         now_ts = AUtils.now_ms()
 
-        to_send = list()
+        items = list()
+        n_dropped = 0
 
         for datum in data:
             if 'timestamp' not in datum.keys():
                 datum['timestamp'] = now_ts
 
-            to_send.append({
-                'mac': int(datum['mac']),
-                'type': int(datum['type']),
-                'data': float(datum['data']),
-                'timestamp': int(datum['timestamp'])
-            })
+            value = float(datum['data'])
+            if not math.isfinite(value):
+                n_dropped += 1
+                continue
+
+            items.append(_BATCH_DATUM_FORMAT(
+                int(datum['mac']),
+                int(datum['type']),
+                value,
+                int(datum['timestamp'])
+            ))
+
+        if n_dropped > 0:
+            logging.getLogger(__name__).warning("Dropped {} readings with NaN / inf data".format(n_dropped))
+
+        return items
 
-        auth_token = self.api_auth.get_token(refresh_if_expired=auth_check)
+    @staticmethod
+    def _serialize_rows(macs: np.ndarray, types: np.ndarray, values: np.ndarray, timestamps: np.ndarray) -> list[str]:
+        """
+        Serialize columns to a list of readings in the batch endpoint's JSON contract
+        """
+        return list(map(_BATCH_DATUM_FORMAT, macs.tolist(), types.tolist(), values.tolist(), timestamps.tolist()))
+
+    def _encode(self, items: list[str]) -> bytes:
+        """
+        Build the (compressed) request body for a list of serialized readings
+        """
+        body = ("[" + ",".join(items) + "]").encode()
+
+        if self.compression == 'gzip':
+            level = self.compression_level if self.compression_level is not None else 6
+            # mtime=0 keeps the output deterministic
+            return gzip.compress(body, compresslevel=level, mtime=0)
+        if self.compression == 'zstd':
+            level = self.compression_level if self.compression_level is not None else 3
+            return zstandard.ZstdCompressor(level=level).compress(body)
+
+        return body
+
+    def _post_items(self, items: list[str], auth_check: bool = False) -> bool:
+        """
+        Send serialized readings, splitting them into several requests if the body is over max_batch_bytes
+        Each request is retried on its own by the transport, so one failed chunk doesn't re-send (or fail) the others
+
+        :return: True if every chunk was accepted, False if otherwise
+        """
+        if len(items) == 0:
+            return True
+
+        body = self._encode(items)
+
+        if self.max_batch_bytes is None or len(body) <= self.max_batch_bytes or len(items) == 1:
+            if self.max_batch_bytes is not None and len(body) > self.max_batch_bytes:
+                self.logger.warning("A single reading is larger than max_batch_bytes ({} bytes)".format(len(body)))
+            return self._post_batch(body, len(items), auth_check)
 
+        # split into roughly budget sized parts, any part that is still too large is split again
+        n_parts = min(math.ceil(len(body) / self.max_batch_bytes), len(items))
+        part_size = math.ceil(len(items) / n_parts)
+
+        success = True
+        for start in range(0, len(items), part_size):
+            if not self._post_items(items[start:start + part_size], auth_check):
+                success = False
+        return success
+
+    def _post_batch(self, body: bytes, n_readings: int, auth_check: bool = False) -> bool:
+        """
+        POST an encoded batch to the batch endpoint
+        The transport retries it on 429 / 503 and connection failures, a 4xx or a false booleanResponse won't
+        succeed on a retry and neither would the other 5xx responses without the risk of storing the readings twice
+
+        :param body: the (compressed) JSON array of readings
+        :param n_readings: the number of readings in the batch (for logging)
+        :param auth_check: whether to perform an authentication check to ensure we have a valid token
+        :return: True if success, False if otherwise
+        """
+        try:
+            if self._send_body(body, auth_check):
+                return True
+        except requests.exceptions.RequestException as e:
+            self.logger.warning("Exception sending batch of {} readings: {}".format(n_readings, e))
+
+        self.logger.error("Could not send batch of {} readings ({} bytes)".format(n_readings, len(body)))
+        return False
+
+    def _send_body(self, body: bytes, auth_check: bool = False) -> bool:
+        """
+        A single POST of an encoded batch to the batch endpoint
+        """
         headers = {
-            "Authorization": "Bearer " + auth_token,
             'Content-type': 'application/json'
         }
+        if self.compression is not None:
+            headers['Content-Encoding'] = self.compression
+
         # note that batch endpoint is always secured
         url = self.api_auth.api_config.get_api_url() + "ingest/std/batch"
 
-        json_data = json.dumps(to_send)
-        # print(json_data)
         # ironically, do not set the json_data parameter, use data= instead
-        response = requests.post(url=url, headers=headers, data=json_data)
+        response = self.api_auth.transport.post(url, refresh_if_expired=auth_check, headers=headers, data=body)
 
         if response.status_code == 200:
 
-            json_response = json.loads(response.content.decode())
-            self.logger.info("API Response:{0}".format(json_response))
+            json_response = json_codec.loads(response.content)
+            self.logger.debug("API Response:{0}".format(json_response))
 
             return json_response['booleanResponse']
 
         else:
-            self.logger.error("Invalid response code:{0}".format(response.status_code))
+            self.logger.warning("Invalid response code:{0}".format(response.status_code))
             return False
@@ -1,10 +1,14 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from auth import APIAuth
-import requests
 from requests.models import PreparedRequest
-import json
+import json_codec
+import numpy as np
+import pandas as pd
 
-from entities import SensorDatum, SensorDataByType, SensorBit
+from entities import SensorDatum, SensorDataByType, SensorBit, SensorDataBlock, MultiMacQueryResult
+from json_stream import iter_json_array
+from sensor_data_cache import SensorDataCache
 
 
 class SensorDataQuery:
@@ -13,8 +17,14 @@ class SensorDataQuery:
     There are many additional options for these queries, so see the function docs
     """
 
-    def __init__(self, api_auth: APIAuth):
+    def __init__(self, api_auth: APIAuth, cache: SensorDataCache = None):
+        """
+        :param api_auth: the APIAuth object
+        :param cache: optional; a SensorDataCache, raw queries are then served from disk and only the time
+        ranges missing from the cache are fetched from the API
+        """
         self.api_auth = api_auth
+        self.cache = cache
         self.logger = logging.getLogger(__name__)
 
     def refresh_token(self):
@@ -37,8 +47,11 @@ class SensorDataQuery:
                  iq_range: float = -1.0,
                  interpolate_data: bool = False,
                  interpolate_timestep: int = 120000,
-                 interpolate_type: int = 0
-                 ) -> list[SensorDatum]:
+                 interpolate_type: int = 0,
+                 columnar: bool = False,
+                 as_frame: bool = False,
+                 use_cache: bool = True
+                 ) -> list[SensorDatum] | SensorDataBlock | pd.DataFrame | None:
         """
         This is the main sensor data query end point, most other data query
         endpoints are rarely used or may ultimately be deprecated
@@ -67,14 +80,313 @@ class SensorDataQuery:
         :param interpolate_data - interpolateData - whether or not to interpolate the data
         :param interpolate_timestep - interpolateTimestep - the interpolation timestep
         :param interpolate_type - interpolateType - the interpolation type (akima, linear_
+        :param columnar - return a SensorDataBlock (int64 timestamps, int32 types, float64 values) instead of
+        a list of SensorDatum objects, no per-point objects are created
+        :param as_frame - return the columnar result as a pandas DataFrame (implies columnar)
+        :param use_cache - whether to use the SensorDataCache (if there is one), only raw queries
+        (no down sampling, moving average, outlier filtering, indexes, offsets or interpolation) are cached
 
-        :return: a dict with
+        :return: a list of SensorDatum objects with
         {
             'mac': device address,
             'type': sensor type,
             'data': the datum,
             'timestamp': unix epoch timestamp
         }
+        or a SensorDataBlock / DataFrame with the same columns if columnar / as_frame are set
+        """
+        is_raw_query = not (down_sample or moving_average or offset_data or interpolate_data or iq_range > 0
+                            or len(requested_indexes) > 0)
+
+        if use_cache and self.cache is not None and is_raw_query:
+            block = self.cache.get(
+                mac, begin, end, types,
+                lambda gap_begin, gap_end: self._fetch_window(mac, gap_begin, gap_end, types, limit,
+                                                              {'use_cache': False})
+            )
+            if block is None:
+                return None
+            return self._format_block(block.take(slice(0, limit)), columnar, as_frame)
+
+        url = self._prepare_url(mac, begin, end, types, limit, down_sample, threshold, moving_average,
+                                window_size, moving_average_type, offset_data, requested_indexes,
+                                arr_ieq_assumptions, iq_range, interpolate_data, interpolate_timestep,
+                                interpolate_type)
+
+        headers = {"X-AIR-Token": str(mac)}
+
+        response = self.api_auth.transport.get(url, headers=headers)
+
+        if response.status_code == 200:
+
+            # the response headers contain the mac of the query if you need it for async calls
+            # we'll put it in the dict for ease of use
+            # normally the WS doesn't return it along with the query as these can be very data intensive calls
+            # and adding a bunch of unnecessary string data to the response just adds overhead
+            mac_rcvd = int(response.headers['X-AIR-Token'])
+
+            if columnar or as_frame:
+                return self._format_block(json_codec.decode_sensor_block(response.content, mac=mac_rcvd), True, as_frame)
+
+            json_response = json_codec.loads(response.content)
+
+            sensor_data = []
+
+            for sensorDatum in json_response:
+                sensor_data.append(
+                    SensorDatum(
+                        mac_rcvd,
+                        sensorDatum.get('type'),
+                        sensorDatum.get('timestamp'),
+                        sensorDatum.get('data')
+                    )
+                )
+
+            return sensor_data
+
+        else:
+            self.logger.warning("Invalid response code:{}".format(response.status_code))
+            return None
+
+    def get_data_many(self, macs: list[int],
+                      begin: int,
+                      end: int,
+                      types: list = [],
+                      max_concurrency: int = 8,
+                      chunked: bool = False,
+                      columnar: bool = False,
+                      as_frame: bool = False,
+                      **query_args) -> MultiMacQueryResult:
+        """
+        Run the same query for many MACs concurrently
+
+        :param macs - the MAC addresses of the devices being queried
+        :param begin - the begin / start timestamp in unix epoch milliseconds (GMT)
+        :param end - the end timestamp in unix epoch milliseconds (GMT)
+        :param types - zero, one or many sensor types
+        :param max_concurrency - the maximum number of MACs queried at the same time
+        :param chunked - use get_data_chunked for each MAC (each MAC then uses its own max_workers pool as well)
+        :param columnar - return SensorDataBlocks instead of lists of SensorDatum objects
+        :param as_frame - return pandas DataFrames (implies columnar)
+        :param query_args - any of the other get_data (or get_data_chunked) query options
+
+        :return: a MultiMacQueryResult with the data keyed by MAC and the reason for any MACs that failed,
+        use to_block() / to_frame() on the result to combine all the MACs into one
+        """
+        query = self.get_data_chunked if chunked else self.get_data
+
+        data = {}
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            futures = {
+                mac: pool.submit(query, mac, begin, end, types, columnar=columnar, as_frame=as_frame, **query_args)
+                for mac in macs
+            }
+            for mac, future in futures.items():
+                try:
+                    mac_data = future.result()
+                except Exception as e:
+                    self.logger.warning("Query for mac:{} failed: {}".format(mac, e))
+                    errors[mac] = str(e)
+                    continue
+
+                if mac_data is None:
+                    errors[mac] = "Invalid response from the API"
+                else:
+                    data[mac] = mac_data
+
+        return MultiMacQueryResult(data=data, errors=errors)
+
+    def get_data_chunked(self, mac: int,
+                         begin: int,
+                         end: int,
+                         types: list = [],
+                         window_ms: int = None,
+                         points_per_window: int = 200000,
+                         probe_ms: int = 60 * 60 * 1000,
+                         max_workers: int = 4,
+                         limit: int = 1000000,
+                         columnar: bool = False,
+                         as_frame: bool = False,
+                         **query_args) -> list[SensorDatum] | SensorDataBlock | pd.DataFrame | None:
+        """
+        Fetch a large time range as many short queries that run concurrently
+        The range is split into windows, each window is fetched on a bounded worker pool, and the results are merged
+        in timestamp order with the duplicated points on the window edges removed
+
+        If a window comes back with limit points it is split in half and re-fetched, so the result is never
+        silently truncated at the query limit
+
+        Note that server side processing (down sampling, moving averages, interpolation, etc.) is applied per window
+
+        :param mac - the MAC address of the device being queried
+        :param begin - the begin / start timestamp in unix epoch milliseconds (GMT)
+        :param end - the end timestamp in unix epoch milliseconds (GMT)
+        :param types - zero, one or many sensor types
+        :param window_ms - the window size in milliseconds, if None the window is sized from the data density
+        of a probe query over the first probe_ms of the range
+        :param points_per_window - the target number of points per window when sizing windows by density
+        :param probe_ms - the length of the density probe query (its result is kept as part of the data)
+        :param max_workers - the maximum number of concurrent requests
+        :param limit - the query size limit for each window
+        :param columnar - return a SensorDataBlock instead of a list of SensorDatum objects
+        :param as_frame - return a pandas DataFrame (implies columnar)
+        :param query_args - any of the other get_data query options
+
+        :return: the merged data, or None if any of the windows could not be fetched
+        """
+        blocks = []
+        start = begin
+
+        if window_ms is None:
+            probe_end = min(begin + probe_ms, end)
+            probe = self._fetch_window(mac, begin, probe_end, types, limit, query_args)
+            if probe is None:
+                return None
+
+            blocks.append(probe)
+            start = probe_end
+
+            if len(probe) > 0:
+                window_ms = int(points_per_window * max(probe_end - begin, 1) / len(probe))
+            else:
+                window_ms = -(-(end - start) // max_workers)
+            window_ms = max(window_ms, 1)
+
+        windows = []
+        while start < end:
+            window_end = min(start + window_ms, end)
+            windows.append((start, window_end))
+            start = window_end
+
+        if len(blocks) == 0 and len(windows) == 0:
+            windows.append((begin, end))
+
+        self.logger.info("Fetching mac:{} in {} windows of {}ms".format(mac, len(windows), window_ms))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(self._fetch_window, mac, window_begin, window_end, types, limit, query_args)
+                for window_begin, window_end in windows
+            ]
+            for future in futures:
+                blocks.append(future.result())
+
+        if any(block is None for block in blocks):
+            self.logger.warning("Could not fetch all the windows for mac:{}".format(mac))
+            return None
+
+        block = SensorDataBlock.concat(blocks).sort_by_time(deduplicate=True)
+
+        return self._format_block(block, columnar, as_frame)
+
+    @staticmethod
+    def _format_block(block: SensorDataBlock, columnar: bool,
+                      as_frame: bool) -> list[SensorDatum] | SensorDataBlock | pd.DataFrame:
+        """
+        Convert a SensorDataBlock to the requested result format
+        """
+        if as_frame:
+            return block.to_frame()
+        if columnar:
+            return block
+        return block.to_sensor_data()
+
+    def _fetch_window(self, mac: int, begin: int, end: int, types: list, limit: int,
+                      query_args: dict) -> SensorDataBlock | None:
+        """
+        Fetch one window of get_data_chunked, splitting it in half whenever the query limit is hit
+        """
+        block = self.get_data(mac, begin, end, types, limit=limit, columnar=True, **query_args)
+
+        if block is None or len(block) < limit or end - begin <= 1:
+            return block
+
+        middle = begin + (end - begin) // 2
+        self.logger.info("Window [{}, {}] hit the query limit, splitting at {}".format(begin, end, middle))
+
+        left = self._fetch_window(mac, begin, middle, types, limit, query_args)
+        right = self._fetch_window(mac, middle, end, types, limit, query_args)
+        if left is None or right is None:
+            return None
+
+        return SensorDataBlock.concat([left, right])
+
+    def iter_data(self, mac: int,
+                  begin: int,
+                  end: int,
+                  types: list = [],
+                  batch_size: int = 100000,
+                  chunk_size: int = 1 << 16,
+                  columnar: bool = False,
+                  **query_args):
+        """
+        Streaming version of get_data for very large queries
+        The response is read in chunks of chunk_size bytes and parsed incrementally, so only one batch of points
+        (plus one network chunk) is held in memory at a time regardless of the size of the query
+
+        :param mac - the MAC address of the device being queried
+        :param begin - the begin / start timestamp in unix epoch milliseconds (GMT)
+        :param end - the end timestamp in unix epoch milliseconds (GMT)
+        :param types - zero, one or many sensor types
+        :param batch_size - the (maximum) number of points in each yielded batch
+        :param chunk_size - the number of bytes read from the socket at a time
+        :param columnar - yield SensorDataBlocks instead of lists of SensorDatum objects
+        :param query_args - any of the other get_data query options (limit, down_sample, iq_range, etc.)
+
+        :return: a generator of batches (list[SensorDatum] or SensorDataBlock)
+        """
+        url = self._prepare_url(mac, begin, end, types, **query_args)
+
+        headers = {"X-AIR-Token": str(mac)}
+
+        with self.api_auth.transport.get(url, headers=headers, stream=True) as response:
+
+            if response.status_code != 200:
+                self.logger.warning("Invalid response code:{}".format(response.status_code))
+                return
+
+            mac_rcvd = int(response.headers['X-AIR-Token'])
+
+            batch = []
+            for sensor_datum in iter_json_array(response.iter_content(chunk_size=chunk_size)):
+                batch.append(sensor_datum)
+                if len(batch) >= batch_size:
+                    yield self._to_batch(batch, mac_rcvd, columnar)
+                    batch = []
+
+            if len(batch) > 0:
+                yield self._to_batch(batch, mac_rcvd, columnar)
+
+    @staticmethod
+    def _to_batch(records: list[dict], mac: int, columnar: bool) -> list[SensorDatum] | SensorDataBlock:
+        if columnar:
+            return SensorDataBlock.from_records(records, mac=mac)
+
+        return [
+            SensorDatum(mac, record.get('type'), record.get('timestamp'), record.get('data')) for record in records
+        ]
+
+    def _prepare_url(self, mac: int,
+                     begin: int,
+                     end: int,
+                     types: list = [],
+                     limit: int = 1000000,
+                     down_sample: bool = False,
+                     threshold: int = 300,
+                     moving_average: bool = False,
+                     window_size: int = 10,
+                     moving_average_type: int = 0,
+                     offset_data: bool = False,
+                     requested_indexes: list = [],
+                     arr_ieq_assumptions: list = [],
+                     iq_range: float = -1.0,
+                     interpolate_data: bool = False,
+                     interpolate_timestep: int = 120000,
+                     interpolate_type: int = 0) -> str:
+        """
+        Build the sensordata/byrange query URL, see get_data for the parameters
         """
         url = self.api_auth.api_config.get_api_url() + "sensordata/byrange"
         params = {
@@ -111,50 +423,32 @@ class SensorDataQuery:
 
         req = PreparedRequest()
         req.prepare_url(url, params)
-        self.logger.info("Request URL:".format(req.url))
-
-        headers = {
-            "Authorization": "Bearer {}".format(self.api_auth.get_token()),
-            "X-AIR-Token": str(mac)}
-
-        response = requests.get(req.url, headers=headers)
-
-        if response.status_code == 200:
-
-            sensor_data = []
-
-            json_response = json.loads(response.content.decode())
+        self.logger.info("Request URL:{}".format(req.url))
 
-            # the response headers contain the mac of the query if you need it for async calls
-            # we'll put it in the dict for ease of use
-            # normally the WS doesn't return it along with the query as these can be very data intensive calls
-            # and adding a bunch of unnecessary string data to the response just adds overhead
-            mac_rcvd = int(response.headers['X-AIR-Token'])
-
-            for sensorDatum in json_response:
-                sensor_data.append(
-                    SensorDatum(
-                        mac_rcvd,
-                        sensorDatum.get('type'),
-                        sensorDatum.get('timestamp'),
-                        sensorDatum.get('data')
-                    )
-                )
-
-            return sensor_data
-
-        else:
-            self.logger.warning("Invalid response code:{}".format(response.status_code))
-            return None
+        return req.url
 
     def print_config(self):
         print(self.api_auth.api_config.get_api_url())
 
     @staticmethod
-    def reshape_by_type(raw_sensor_data: list[dict]) -> dict[int, SensorDataByType]:
+    def reshape_by_type(raw_sensor_data: list[dict] | SensorDataBlock) -> dict[int, SensorDataByType] | dict[int, SensorDataBlock]:
         """
         Reshape a standard query response into a type indexed dict
+        If a SensorDataBlock is passed in, the values of the dict are SensorDataBlocks
+        (one per type, in their original order) rather than SensorDataByType objects
         """
+        if isinstance(raw_sensor_data, SensorDataBlock):
+            # a stable sort keeps each type's points in their original (timestamp) order
+            order = np.argsort(raw_sensor_data.types, kind='stable')
+            sorted_types = raw_sensor_data.types[order]
+            unique_types, starts = np.unique(sorted_types, return_index=True)
+            ends = np.append(starts[1:], len(sorted_types))
+
+            return {
+                int(sensor_type): raw_sensor_data.take(order[start:end])
+                for sensor_type, start, end in zip(unique_types, starts, ends)
+            }
+
         sensor_data_reshaped = dict[int, SensorDataByType]()
 
         for datum in raw_sensor_data:
@@ -1,17 +1,69 @@
+import logging
+import threading
+import time
+
 from auth import APIAuth
+import json_codec
+import numpy as np
 import requests
-import json
+from snapshot import load_snapshot, write_snapshot
 
 
 class APISensorTypeInfo:
     """
     Helper class to fetch all of the Aretas sensor type info metadata
     Includes helper functions to map type units to SensorTypeInfo classes
+
+    The metadata is indexed by type when it is loaded, so lookups don't scan the list
     """
-    def __init__(self, api_auth: APIAuth):
+    def __init__(self, api_auth: APIAuth, snapshot_path: str = None, lazy: bool = False, retry_interval: float = 60):
+        """
+        :param api_auth: the APIAuth object
+        :param snapshot_path: optional; a local file the metadata is saved to whenever it changes, if it exists the
+        metadata is loaded from it straight away and refreshed from the API in the background instead of blocking here
+        :param lazy: optional; don't fetch the metadata until the first lookup
+        :param retry_interval: optional; the seconds lookups wait after a failed lazy fetch before fetching again,
+        in the meantime they find no metadata
+        """
         self.api_auth = api_auth
+        self.snapshot_path = snapshot_path
+        self.retry_interval = retry_interval
+        self.logger = logging.getLogger(__name__)
+        self._load_lock = threading.Lock()
+        self._retry_at = 0.0
         self.sensor_type_metadata = None
-        self.refresh_sensor_type_into()
+
+        snapshot = load_snapshot(snapshot_path) if snapshot_path is not None else None
+        if snapshot is not None and not self._is_metadata_list(snapshot[0]):
+            self.logger.warning("Snapshot {} is not a sensor type metadata list, fetching the metadata from the API"
+                                .format(snapshot_path))
+            snapshot = None
+
+        if snapshot is not None:
+            self.sensor_type_metadata = snapshot[0]
+            threading.Thread(target=self._refresh, name="SensorTypeInfoRefresh", daemon=True).start()
+        elif not lazy:
+            self.refresh_sensor_type_into()
+
+    @property
+    def sensor_type_metadata(self) -> list | None:
+        """The sensor type metadata list as returned by the API"""
+        return self._sensor_type_metadata
+
+    @sensor_type_metadata.setter
+    def sensor_type_metadata(self, sensor_type_metadata: list | None):
+        by_type = {}
+        labels = {}
+        for sensor_type_info in sensor_type_metadata or []:
+            sensor_type = int(sensor_type_info['type'])
+            # keep the first entry for a type, like the old linear scan did
+            if sensor_type not in by_type:
+                by_type[sensor_type] = sensor_type_info
+                labels[sensor_type] = sensor_type_info['label'] + " " + sensor_type_info['units']
+
+        # the index is swapped in whole so readers on other threads never see a partial one
+        self._index = (by_type, labels, {})
+        self._sensor_type_metadata = sensor_type_metadata
 
     def refresh_sensor_type_into(self):
         """Fetch all the sensor type metadata"""
@@ -21,37 +73,98 @@ class APISensorTypeInfo:
             "Accept": "application/json"
         }
 
-        response = requests.get(base_url, headers=headers)
+        response = self.api_auth.transport.get(base_url, authenticate=False, headers=headers)
 
         if response.status_code == 200:
 
-            self.sensor_type_metadata = json.loads(response.content.decode())
+            sensor_type_metadata = json_codec.loads(response.content)
+            if self.snapshot_path is not None and sensor_type_metadata != self.sensor_type_metadata:
+                write_snapshot(self.snapshot_path, sensor_type_metadata)
+            self.sensor_type_metadata = sensor_type_metadata
 
         else:
-            print("Invalid response code:")
-            print(response.status_code)
-            print('\n')
+            self.logger.warning("Invalid response code:{}".format(response.status_code))
             return None
 
+    def _refresh(self):
+        """
+        Refreshes the snapshot loaded metadata from the API in the background
+        """
+        try:
+            self.refresh_sensor_type_into()
+        except Exception as e:
+            self.logger.warning("Exception refreshing the sensor type metadata: {}".format(e))
+
+    @staticmethod
+    def _is_metadata_list(document) -> bool:
+        """whether a document looks like the sensortype/list response (a list of objects with a type)"""
+        return isinstance(document, list) and all(isinstance(item, dict) and 'type' in item for item in document)
+
     def get_sensor_type_metadata(self, sensor_type: int):
         """ get the sensor type metadata object for that sensor type if one exists
             :param sensor_type - the integer sensor type
         """
-        for sensor_type_info in self.sensor_type_metadata:
-            if int(sensor_type_info['type']) == sensor_type:
-                return sensor_type_info
-
-        return None
+        return self._get_index()[0].get(int(sensor_type))
 
     def get_labels(self, types: list):
         """ get a list of labels for a list of sensor types if available, otherwise return the type int as a str
             :param types - a list of sensor types (integers)
         """
-        ret = []
-        for s_type in types:
-            s_type_obj = self.get_sensor_type_metadata(int(s_type))
-            if s_type_obj is not None:
-                ret.append(s_type_obj['label'] + " " + s_type_obj['units'])
-            else:
-                ret.append(str(s_type))
-        return ret
+        _, labels, labels_cache = self._get_index()
+
+        # the same set of types is usually looked up over and over (e.g. once per streamed row)
+        key = tuple(types)
+        ret = labels_cache.get(key)
+        if ret is None:
+            ret = [labels.get(int(s_type), str(s_type)) for s_type in types]
+            if len(labels_cache) >= 1024:
+                labels_cache.clear()
+            labels_cache[key] = ret
+
+        return list(ret)
+
+    def get_metadata_many(self, types) -> list:
+        """ get the sensor type metadata objects (or None) for many sensor types
+            :param types - a list or array of sensor types
+        """
+        by_type = self._get_index()[0]
+        return [by_type.get(int(s_type)) for s_type in types]
+
+    def get_labels_array(self, types) -> np.ndarray:
+        """ vectorized get_labels, map an array of sensor types (e.g. SensorDataBlock.types) to an array of labels
+            each distinct type is only looked up once
+            :param types - an array of sensor types
+        """
+        labels = self._get_index()[1]
+        unique_types, inverse = np.unique(np.asarray(types, dtype=np.int64), return_inverse=True)
+        unique_labels = np.array([labels.get(s_type, str(s_type)) for s_type in unique_types.tolist()], dtype=object)
+        return unique_labels[inverse.reshape(-1)]
+
+    def get_field_array(self, types, field: str, default=None) -> np.ndarray:
+        """ map an array of sensor types to an array of one metadata field (e.g. 'units', 'label', 'charCode')
+            :param types - an array of sensor types
+            :param field - the metadata field
+            :param default - the value for types without metadata (or without the field)
+        """
+        by_type = self._get_index()[0]
+        unique_types, inverse = np.unique(np.asarray(types, dtype=np.int64), return_inverse=True)
+        unique_values = np.array(
+            [by_type.get(s_type, {}).get(field, default) for s_type in unique_types.tolist()], dtype=object
+        )
+        return unique_values[inverse.reshape(-1)]
+
+    def _get_index(self) -> tuple[dict, dict, dict]:
+        """
+        the (metadata by type, label by type, labels cache) index, fetching the metadata on first use
+        after a failed fetch the index stays empty and the fetch isn't tried again for retry_interval seconds
+        """
+        if self._sensor_type_metadata is None and time.monotonic() >= self._retry_at:
+            with self._load_lock:
+                if self._sensor_type_metadata is None and time.monotonic() >= self._retry_at:
+                    try:
+                        self.refresh_sensor_type_into()
+                    except requests.exceptions.RequestException as e:
+                        self.logger.warning("Could not fetch the sensor type metadata: {}".format(e))
+                    if self._sensor_type_metadata is None:
+                        self._retry_at = time.monotonic() + self.retry_interval
+        return self._index
@@ -0,0 +1,53 @@
+import logging
+import os
+import time
+from typing import Any
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+
+def load_snapshot(path: str) -> tuple[Any, int | None] | None:
+    """
+    Load a metadata snapshot written by write_snapshot
+    A plain JSON document is accepted as well, with no saved time. Either way the data isn't validated, the caller
+    checks it has the shape it expects
+
+    :param path: the snapshot file
+    :return: (data, saved_at unix epoch ms or None), or None if there is no (readable) snapshot
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            document = json_codec.loads(snapshot_file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read snapshot {}: {}".format(path, e))
+        return None
+
+    if isinstance(document, dict) and set(document.keys()) == {"savedAt", "data"}:
+        return document["data"], document["savedAt"]
+
+    return document, None
+
+
+def write_snapshot(path: str, data: Any):
+    """
+    Atomically write a metadata snapshot (readers see either the old or the new file, never a partial one)
+
+    :param path: the snapshot file (its directory is created if it doesn't exist)
+    :param data: the decoded API response to save
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as snapshot_file:
+            snapshot_file.write(json_codec.dumps({"savedAt": int(time.time() * 1000), "data": data}))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not write snapshot {}: {}".format(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,281 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from entities import SensorDataBlock
+from sensor_data_query import SensorDataQuery
+from utils import Utils
+
+# a recording is this header followed by fixed size little endian records
+STREAM_FILE_MAGIC = b"ARSTREAM1\n"
+STREAM_RECORD_DTYPE = np.dtype([
+    ("mac", "<i8"),
+    ("type", "<i4"),
+    ("timestamp", "<i8"),
+    ("data", "<f8"),
+    ("received", "<i8")
+])
+
+
+def load_stream(path: str) -> np.ndarray:
+    """
+    Read a recording written by StreamRecorder
+
+    :param path: the recording file
+    :return: a structured array with mac, type, timestamp, data and received (unix epoch ms) fields
+    :raises ValueError: if the file isn't a recording
+    """
+    with open(path, "rb") as stream_file:
+        if stream_file.read(len(STREAM_FILE_MAGIC)) != STREAM_FILE_MAGIC:
+            raise ValueError("{} is not a stream recording".format(path))
+        data = stream_file.read()
+
+    # a record cut short by a crash is ignored
+    n = len(data) // STREAM_RECORD_DTYPE.itemsize
+    return np.frombuffer(data, dtype=STREAM_RECORD_DTYPE, count=n)
+
+
+class StreamRecorder:
+    """
+    Records streamed datums to a compact append-only file (36 bytes per datum) and passes them on
+
+    A StreamRecorder is a message callback, wrap the real callback to tee a websocket stream to disk:
+        SensorDataWebsocket(auth, location_id, macs, StreamRecorder("gym.stream", process_message))
+
+    Records are buffered and appended every flush_every datums (and on flush / close)
+    """
+
+    def __init__(self, path: str, message_callback=None, flush_every: int = 1000):
+        """
+        :param path: the recording file, appended to if it exists
+        :raises ValueError: if path exists and isn't a recording
+        :param message_callback: optional; the callback each datum is passed on to
+        :param flush_every: the number of datums buffered before they are written
+        """
+        self.path = path
+        self.message_callback = message_callback
+        self.flush_every = flush_every
+        self.recorded = 0
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._buffer = np.empty(flush_every, dtype=STREAM_RECORD_DTYPE)
+        self._n = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(STREAM_FILE_MAGIC)
+            self._file.flush()
+
+    def __call__(self, datum: dict):
+        with self._lock:
+            self._buffer[self._n] = (datum['mac'], datum['type'], datum['timestamp'], datum['data'], Utils.now_ms())
+            self._n += 1
+            self.recorded += 1
+            if self._n >= self.flush_every:
+                self._write()
+
+        if self.message_callback is not None:
+            self.message_callback(datum)
+
+    def flush(self):
+        """
+        Write the buffered records
+        """
+        with self._lock:
+            self._write()
+
+    def close(self):
+        """
+        Write the buffered records and close the file
+        The wrapped callback is closed too if it has a close() (e.g. a MicroBatcher)
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write()
+            self._file.close()
+
+        close = getattr(self.message_callback, "close", None)
+        if callable(close):
+            close()
+
+    def _recover(self):
+        """
+        Check an existing recording and trim a partially written record (or header) left by a crash,
+        so the records appended to it stay aligned
+
+        :raises ValueError: if the file isn't a recording
+        """
+        if not os.path.exists(self.path):
+            return
+
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as stream_file:
+            header = stream_file.read(len(STREAM_FILE_MAGIC))
+            if header != STREAM_FILE_MAGIC:
+                if not STREAM_FILE_MAGIC.startswith(header):
+                    raise ValueError("{} is not a stream recording".format(self.path))
+                # the header itself was cut short, start over
+                stream_file.truncate(0)
+                return
+
+            partial = (size - len(STREAM_FILE_MAGIC)) % STREAM_RECORD_DTYPE.itemsize
+            if partial != 0:
+                stream_file.truncate(size - partial)
+                self.logger.warning("Trimmed a partially written record from recording {}".format(self.path))
+
+    def _write(self):
+        """(the caller holds the lock)"""
+        if self._n == 0 or self._file.closed:
+            return
+        self._file.write(self._buffer[:self._n].tobytes())
+        self._file.flush()
+        self._n = 0
+
+
+@dataclass
+class ReplayStats:
+    """
+    What a StreamReplayer measured, the latency is the time spent in the message callback per datum
+    """
+    datums: int
+    elapsed_s: float
+    throughput: float
+    latency_mean_ms: float
+    latency_p50_ms: float
+    latency_p99_ms: float
+    latency_max_ms: float
+    max_behind_ms: float
+
+    def __str__(self):
+        return ("{} datums in {:.2f}s ({:.0f}/s), callback latency mean {:.3f}ms p50 {:.3f}ms p99 {:.3f}ms "
+                "max {:.3f}ms, at most {:.0f}ms behind schedule").format(
+            self.datums, self.elapsed_s, self.throughput, self.latency_mean_ms, self.latency_p50_ms,
+            self.latency_p99_ms, self.latency_max_ms, self.max_behind_ms)
+
+
+class StreamReplayer:
+    """
+    Feeds recorded or historical sensor data to a message callback, like SensorDataWebsocket does, for load testing
+    stream consumers offline
+
+    speed sets the pace: 1.0 replays in real time, 10.0 ten times faster and None (or 0) as fast as the callback
+    keeps up. Recordings are paced by the time the datums were received, historical data by their timestamps
+    """
+
+    def __init__(self, message_callback, speed: float | None = 1.0):
+        """
+        :param message_callback: called with each datum,
+        e.g. { 'mac': 1234, 'type': 123, 'data': 0.00, 'timestamp': 1234567 }
+        :param speed: the replay speed factor, None or 0 for maximum speed
+        """
+        self.message_callback = message_callback
+        self.speed = speed
+        self.logger = logging.getLogger(__name__)
+        self._stop = threading.Event()
+
+    def replay_file(self, path: str) -> ReplayStats:
+        """
+        Replay a recording written by StreamRecorder
+
+        :param path: the recording file
+        :return: the measured ReplayStats
+        """
+        records = load_stream(path)
+        return self._replay(records["mac"], records["type"], records["timestamp"], records["data"],
+                            records["received"])
+
+    def replay_query(self, sensor_data_query: SensorDataQuery, macs: list[int], begin: int, end: int,
+                     types: list = []) -> ReplayStats | None:
+        """
+        Replay historical data of one or many macs, interleaved in timestamp order
+
+        :param sensor_data_query: the SensorDataQuery used to fetch the data
+        :param macs: the macs to replay
+        :param begin: the begin timestamp in unix epoch milliseconds
+        :param end: the end timestamp in unix epoch milliseconds
+        :param types: zero, one or many sensor types (all the types of each mac if none)
+        :return: the measured ReplayStats, or None if the query failed
+        """
+        result = sensor_data_query.get_data_many(macs, begin, end, types, columnar=True)
+        if len(result.errors) > 0:
+            self.logger.warning("Could not fetch the data of macs {}".format(list(result.errors.keys())))
+            return None
+
+        return self.replay_block(result.to_block())
+
+    def replay_block(self, block: SensorDataBlock) -> ReplayStats:
+        """
+        Replay a SensorDataBlock in timestamp order
+        """
+        return self._replay(block.macs, block.types, block.timestamps, block.values, block.timestamps)
+
+    def stop(self):
+        """
+        Stop a replay running on another thread
+        """
+        self._stop.set()
+
+    def _replay(self, macs: np.ndarray, types: np.ndarray, timestamps: np.ndarray, values: np.ndarray,
+                pace: np.ndarray) -> ReplayStats:
+        order = np.argsort(pace, kind="stable")
+        n = len(order)
+        latencies = np.zeros(n, dtype=np.float64)
+        max_behind = 0.0
+        speed = self.speed or None
+        self._stop.clear()
+
+        # plain python ints / floats for the datum dicts, like the websocket delivers
+        macs = macs[order].tolist()
+        types = types[order].tolist()
+        timestamps = timestamps[order].tolist()
+        values = values[order].tolist()
+        # the time of each datum relative to the start of the replay, in seconds
+        offsets = ((pace[order] - pace[order[0]]) / 1000 / speed).tolist() if speed and n > 0 else None
+
+        perf_counter = time.perf_counter
+        message_callback = self.message_callback
+        start = perf_counter()
+
+        i = 0
+        for i in range(n):
+            if offsets is not None:
+                ahead = offsets[i] - (perf_counter() - start)
+                if ahead > 0.001:
+                    if self._stop.wait(ahead):
+                        break
+                elif ahead < 0:
+                    max_behind = max(max_behind, -ahead)
+            elif self._stop.is_set():
+                break
+
+            called = perf_counter()
+            try:
+                message_callback({'mac': macs[i], 'type': types[i], 'timestamp': timestamps[i], 'data': values[i]})
+            except Exception as e:
+                self.logger.warning("Exception in the message callback: {}".format(e))
+            latencies[i] = perf_counter() - called
+        else:
+            i = n
+
+        elapsed = perf_counter() - start
+        latencies = latencies[:i] * 1000
+
+        return ReplayStats(
+            datums=i,
+            elapsed_s=elapsed,
+            throughput=i / elapsed if elapsed > 0 else 0.0,
+            latency_mean_ms=float(latencies.mean()) if i > 0 else 0.0,
+            latency_p50_ms=float(np.percentile(latencies, 50)) if i > 0 else 0.0,
+            latency_p99_ms=float(np.percentile(latencies, 99)) if i > 0 else 0.0,
+            latency_max_ms=float(latencies.max()) if i > 0 else 0.0,
+            max_behind_ms=max_behind * 1000
+        )
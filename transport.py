@@ -0,0 +1,233 @@
+import datetime
+import email.utils
+import logging
+import math
+import random
+import time
+from urllib.parse import urlparse
+
+import requests
+import urllib3.exceptions
+from requests.adapters import HTTPAdapter
+
+# responses worth retrying after a pause
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+# a non idempotent request (e.g. an ingest POST) is only replayed when the server says it didn't process it,
+# after a 500 / 502 / 504 it may have, and replaying could duplicate readings
+NON_IDEMPOTENT_RETRY_STATUS_CODES = frozenset([429, 503])
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10.0, 60.0)
+ENDPOINT_TIMEOUTS = {
+    "sensordata/byrange": (10.0, 300.0),
+    "ingest/std/batch": (10.0, 120.0),
+}
+
+
+def retry_delay(headers, attempt: int, backoff_factor: float, max_backoff: float) -> float:
+    """
+    How long to wait before retrying a request
+    The Retry-After header is honoured when the server sends one, otherwise it's exponential backoff
+    with full jitter so that many clients backing off at once don't retry in lock step
+
+    :param headers: the headers of the failed response (or None if there was no response)
+    :param attempt: the number of the retry (0 for the first)
+    :param backoff_factor: the base delay in seconds
+    :param max_backoff: the maximum delay in seconds
+    :return: the delay in seconds
+    """
+    retry_after = headers.get("Retry-After") if headers is not None else None
+    if retry_after is not None:
+        try:
+            seconds = float(retry_after)
+            if not math.isnan(seconds):
+                return min(max(seconds, 0.0), max_backoff)
+        except ValueError:
+            pass
+
+        # an HTTP-date, anything else (e.g. "soon") is ignored
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            retry_at = None
+        if retry_at is not None:
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+            return min(max(retry_at.timestamp() - time.time(), 0.0), max_backoff)
+
+    return random.uniform(0, min(max_backoff, backoff_factor * (2 ** attempt)))
+
+
+def is_retry_status(method: str, status_code: int) -> bool:
+    """
+    Whether a response with this status code is worth retrying for the method
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return status_code in RETRY_STATUS_CODES
+    return status_code in NON_IDEMPOTENT_RETRY_STATUS_CODES
+
+
+def _request_not_sent(e: requests.exceptions.RequestException) -> bool:
+    """Whether a connection error happened before any of the request was sent (the connection was never made)"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+
+
+class APITransport:
+    """
+    Pooled HTTP transport shared by all of the API clients
+    A single requests.Session is used so TCP connections (and their TLS sessions) are kept alive
+    and re-used between calls instead of being re-negotiated for every request
+
+    The transport is owned by APIAuth, so every class that takes an APIAuth object gets the same pool
+
+    Every request also goes through the same retry policy: a request rejected with 401 / 403 is replayed once with
+    a refreshed token, 429 and 5xx responses and connection failures are retried with exponential backoff and
+    jitter (honouring Retry-After), and each request has a (per endpoint) timeout so a slow server can't hang a thread
+    Non idempotent requests (POST) are only retried on 429 / 503 or when the connection couldn't be made, so an
+    ingest batch the server may already have stored is never sent twice
+    """
+
+    def __init__(self, api_auth, pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False,
+                 max_retries: int = 3, backoff_factor: float = 0.5, max_backoff: float = 30.0,
+                 timeout: tuple[float, float] = DEFAULT_TIMEOUT):
+        """
+        :param api_auth: the APIAuth object used to add the bearer token to authenticated requests
+        :param pool_connections: the number of per-host connection pools to cache
+        :param pool_maxsize: the maximum number of connections kept alive per host
+        :param pool_block: whether to block (rather than open a throwaway connection) when a host pool is exhausted
+        :param max_retries: the maximum number of retries after 429 / 5xx responses or connection failures
+        :param backoff_factor: the base delay between retries in seconds
+        :param max_backoff: the maximum delay between retries in seconds
+        :param timeout: the default (connect, read) timeout in seconds, see set_timeout for per endpoint timeouts
+        """
+        self.api_auth = api_auth
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.endpoint_timeouts = dict(ENDPOINT_TIMEOUTS)
+        self.logger = logging.getLogger(__name__)
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def configure_host(self, url_prefix: str, pool_maxsize: int, pool_block: bool = False):
+        """
+        Give a particular host (or URL prefix) its own connection pool size
+        e.g. configure_host("https://iot.aretas.ca/", 64) when polling thousands of devices from many threads
+
+        :param url_prefix: the URL prefix the pool applies to (the longest matching prefix wins)
+        :param pool_maxsize: the maximum number of connections kept alive for that prefix
+        :param pool_block: whether to block when the pool is exhausted
+        """
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount(url_prefix, adapter)
+
+    def set_timeout(self, endpoint: str, timeout: tuple[float, float] | float):
+        """
+        Set the timeout for an endpoint, e.g. set_timeout("sensordata/byrange", (10, 600))
+
+        :param endpoint: the endpoint path (relative to the API URL), the longest matching endpoint wins
+        :param timeout: the (connect, read) timeout in seconds, or a single value for both
+        """
+        self.endpoint_timeouts[endpoint] = timeout
+
+    def timeout_for(self, url: str) -> tuple[float, float] | float:
+        """
+        Get the timeout for a URL
+        """
+        path = urlparse(url).path
+        matches = [endpoint for endpoint in self.endpoint_timeouts if endpoint in path]
+        if len(matches) == 0:
+            return self.timeout
+        return self.endpoint_timeouts[max(matches, key=len)]
+
+    def auth_headers(self, headers: dict = None, refresh_if_expired: bool = False) -> dict:
+        """
+        Get a copy of headers with the Authorization header added
+
+        :param headers: any additional headers for the request
+        :param refresh_if_expired: passed through to APIAuth.get_token
+        :return: the merged headers
+        """
+        ret = dict(headers) if headers else dict()
+        token = self.api_auth.get_token(refresh_if_expired=refresh_if_expired)
+        if token is not None:
+            ret["Authorization"] = "Bearer " + token
+        return ret
+
+    def request(self, method: str, url: str,
+                authenticate: bool = True,
+                refresh_if_expired: bool = False,
+                headers: dict = None,
+                retry: bool = True,
+                **kwargs) -> requests.Response:
+        """
+        Send a request over the pooled session
+
+        :param method: the HTTP verb
+        :param url: the full URL of the endpoint
+        :param authenticate: whether to add the bearer token to the request
+        :param refresh_if_expired: passed through to APIAuth.get_token
+        :param headers: any additional headers for the request
+        :param retry: whether to apply the retry policy (token refresh and replay, backoff on 429 / 5xx,
+        only on 429 / 503 for non idempotent methods such as POST)
+        :param kwargs: passed through to requests.Session.request (params, data, json, stream, timeout, etc.)
+        :return: the requests.Response object (the last one if the request was retried)
+        """
+        kwargs.setdefault("timeout", self.timeout_for(url))
+        max_retries = self.max_retries if retry else 0
+        # a token that was handed to APIAuth can't be refreshed, so there is nothing to replay with
+        replayed = not (retry and authenticate) or self.api_auth._token_provided
+        attempt = 0
+
+        while True:
+            request_headers = self.auth_headers(headers, refresh_if_expired) if authenticate else headers
+
+            try:
+                response = self.session.request(method, url, headers=request_headers, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # the server may have acted on the request, only replay it if it's idempotent or was never sent
+                replayable = method.upper() in IDEMPOTENT_METHODS or _request_not_sent(e)
+                if attempt >= max_retries or not replayable:
+                    raise
+                delay = retry_delay(None, attempt, self.backoff_factor, self.max_backoff)
+                self.logger.warning("{} {} failed ({}), retrying in {:.1f}s".format(method, url, e, delay))
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code in (401, 403) and not replayed:
+                replayed = True
+                rejected = (request_headers or {}).get("Authorization", "")[len("Bearer "):]
+                self.logger.info("Response [{}], refreshing authtoken and replaying the request"
+                                 .format(response.status_code))
+                response.close()
+                self.api_auth.refresh_token(stale_token=rejected or None)
+                continue
+
+            if is_retry_status(method, response.status_code) and attempt < max_retries:
+                delay = retry_delay(response.headers, attempt, self.backoff_factor, self.max_backoff)
+                self.logger.warning("Response [{}] from {}, retrying in {:.1f}s".format(response.status_code, url, delay))
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """Close all the pooled connections"""
+        self.session.close()
@@ -1,9 +1,9 @@
 import logging
-import requests
 from typing import Optional
 
 from api_config import APIConfig
 from auth import APIAuth
+import json_codec
 
 
 class TimeZoneAPIClient:
@@ -20,6 +20,7 @@ class TimeZoneAPIClient:
         """
         # Ensure no trailing slash for proper URL construction
         self.base_url = api_auth.api_config.get_api_url()
+        self.api_auth = api_auth
         self.logger = logging.getLogger(__name__)
 
     def get_timezone_id(self, lat: float, lon: float) -> Optional[str]:
@@ -35,9 +36,9 @@ class TimeZoneAPIClient:
         """
         url = f"{self.base_url}timezone/query?lat={lat}&lon={lon}"
         try:
-            response = requests.get(url)
+            response = self.api_auth.transport.get(url, authenticate=False)
             if response.status_code == 200:
-                data = response.json()
+                data = json_codec.loads(response.content)
                 # Expecting the JSON to contain keys "booleanResponse" and "message"
                 if data.get("booleanResponse"):
                     return data.get("message")